@@ -1,4 +1,7 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from decimal import Decimal
 
@@ -7,6 +10,7 @@ from product.models import Product, Brand
 
 class HomeViewTests(TestCase):
 	def setUp(self):
+		cache.clear()
 		# Create a brand to avoid related lookup errors in template
 		self.brand = Brand.objects.create(nombre='MarcaTest')
 
@@ -49,3 +53,23 @@ class HomeViewTests(TestCase):
 		self.assertEqual(response.status_code, 200)
 		self.assertContains(response, 'No hay productos destacados disponibles')
 
+
+	def test_home_prefers_destacados_and_skips_random_sort(self):
+		destacados = [
+			Product.objects.create(nombre=f'Destacado {i}', precio=Decimal('9.99'), destacado=True, marca=self.brand)
+			for i in range(3)
+		]
+		self.client.get(reverse('home'))
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(reverse('home'))
+		self.assertEqual({p.pk for p in response.context['productos_destacados']}, {p.pk for p in destacados})
+		self.assertFalse([q for q in ctx.captured_queries if 'RANDOM()' in q['sql'].upper()])
+
+	def test_home_pool_refreshes_when_catalog_changes(self):
+		self.client.get(reverse('home'))
+		nuevos = [
+			Product.objects.create(nombre=f'Nuevo {i}', precio=Decimal('9.99'), destacado=True, marca=self.brand)
+			for i in range(3)
+		]
+		response = self.client.get(reverse('home'))
+		self.assertEqual({p.pk for p in response.context['productos_destacados']}, {p.pk for p in nuevos})
@@ -1,6 +1,10 @@
 from django.shortcuts import render
-from product.models import Product
+from product.destacados import destacados
+from product.tarjetas import tarjetas
 
 def home(request):
-    productos_destacados = Product.objects.filter(disponible=True).order_by('?')[:3]
-    return render(request, 'home.html', {'productos_destacados': productos_destacados})
\ No newline at end of file
+    productos_destacados = destacados(3)
+    return render(request, 'home.html', {
+        'productos_destacados': productos_destacados,
+        'tarjetas': tarjetas(productos_destacados, 'product_card_destacado.html'),
+    })
\ No newline at end of file
@@ -0,0 +1,199 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from product.models import Product
+from .models import Carrito, ItemCarrito
+from .stock import devolver_stock_lineas
+
+COOKIE_CARRITO = 'carrito'
+SALT_CARRITO = 'pedido.carrito'
+
+
+class LineaAnonima:
+    """Línea de un CarritoAnonimo con la misma forma que ItemCarrito para las plantillas."""
+
+    cantidad_reservada = 0
+
+    def __init__(self, id, producto, talla, cantidad):
+        self.id = id
+        self.producto = producto
+        self.producto_id = producto.id
+        self.talla = talla
+        self.cantidad = cantidad
+
+
+class CarritoAnonimo:
+    """
+    Carrito de un visitante sin cuenta guardado en una cookie firmada, sin tocar la BD.
+    No reserva stock: sus líneas se pasan a Carrito/ItemCarrito al hacer el pedido o al
+    iniciar sesión. `carrito_id` apunta al Carrito de BD si ya se ha persistido.
+
+    Cada línea se guarda como [id, producto_id, talla, cantidad]; el precio no se guarda,
+    se lee siempre del producto.
+    """
+
+    def __init__(self, datos=None):
+        datos = datos or {}
+        # Las cookies anteriores guardaban también el precio como quinto elemento
+        self._lineas = [list(linea[:4]) for linea in datos.get('l', [])]
+        self._productos_cargados = None
+        self._siguiente_id = datos.get('n', 1)
+        self.carrito_id = datos.get('c')
+        self.modificado = False
+
+    @classmethod
+    def desde_peticion(cls, request):
+        valor = request.get_signed_cookie(
+            COOKIE_CARRITO, default=None, salt=SALT_CARRITO, max_age=settings.CARRITO_COOKIE_SEGUNDOS
+        )
+        try:
+            return cls(json.loads(valor)) if valor else cls()
+        except (ValueError, TypeError):
+            return cls()
+
+    def guardar(self, response):
+        if not self._lineas and not self.carrito_id:
+            response.delete_cookie(COOKIE_CARRITO)
+            return
+        datos = {'l': self._lineas, 'n': self._siguiente_id}
+        if self.carrito_id:
+            datos['c'] = self.carrito_id
+        response.set_signed_cookie(
+            COOKIE_CARRITO, json.dumps(datos, separators=(',', ':')), salt=SALT_CARRITO,
+            max_age=settings.CARRITO_COOKIE_SEGUNDOS, httponly=True, samesite='Lax',
+        )
+
+    def _productos(self):
+        """
+        Productos de las líneas, cargados con una sola consulta. Las líneas de productos
+        que ya no existen se quitan (y la cookie se reescribe).
+        """
+        ids = {linea[1] for linea in self._lineas}
+        if self._productos_cargados is None or not ids <= self._productos_cargados.keys():
+            self._productos_cargados = Product.objects.in_bulk(ids)
+            vivas = [linea for linea in self._lineas if linea[1] in self._productos_cargados]
+            if len(vivas) != len(self._lineas):
+                self._lineas = vivas
+                self.modificado = True
+        return self._productos_cargados
+
+    # --- Resumen (mismos nombres que las columnas de Carrito) ---
+    # Salen de la cookie sin consultar productos: el navbar los pinta en cada página.
+    # Las líneas de productos borrados se quitan al cargarlos (lineas() y persistir()).
+
+    @property
+    def num_lineas(self):
+        return len(self._lineas)
+
+    @property
+    def num_unidades(self):
+        return sum(linea[3] for linea in self._lineas)
+
+    # --- Lectura ---
+
+    def _buscar(self, linea_id):
+        for linea in self._lineas:
+            if linea[0] == linea_id:
+                return linea
+        raise ItemCarrito.DoesNotExist('La línea no está en el carrito.')
+
+    def cantidad_de(self, producto_id, talla):
+        for linea in self._lineas:
+            if linea[1] == producto_id and linea[2] == talla:
+                return linea[3]
+        return 0
+
+    def linea(self, linea_id):
+        return tuple(self._buscar(linea_id))
+
+    def filas(self):
+        """Líneas en crudo `(id, producto_id, talla, cantidad)`, sin consultar productos."""
+        return [tuple(linea) for linea in self._lineas]
+
+    def lineas(self):
+        """Líneas con su producto cargado (una consulta para todo el carrito)."""
+        productos = self._productos()
+        return [
+            LineaAnonima(linea_id, productos[producto_id], talla, cantidad)
+            for linea_id, producto_id, talla, cantidad in self._lineas
+        ]
+
+    def get_total(self):
+        return sum((linea.producto.precio_final * linea.cantidad for linea in self.lineas()), Decimal('0.00'))
+
+    def get_cantidad_items(self):
+        return self.num_unidades
+
+    # --- Modificación ---
+
+    def agregar(self, producto, talla, cantidad):
+        self.fijar_cantidad(producto.id, talla, self.cantidad_de(producto.id, talla) + cantidad, producto)
+
+    def fijar_cantidad(self, producto_id, talla, cantidad, producto=None):
+        """Deja el SKU con `cantidad` unidades (0 lo quita)."""
+        for linea in self._lineas:
+            if linea[1] == producto_id and linea[2] == talla:
+                if cantidad <= 0:
+                    self._lineas.remove(linea)
+                else:
+                    linea[3] = cantidad
+                break
+        else:
+            if cantidad > 0:
+                self._lineas.append([self._siguiente_id, producto_id, talla, cantidad])
+                self._siguiente_id += 1
+                if producto is not None and self._productos_cargados is not None:
+                    self._productos_cargados[producto_id] = producto
+        self.modificado = True
+
+    def actualizar(self, linea_id, cantidad):
+        linea = self._buscar(linea_id)
+        if cantidad <= 0:
+            self._lineas.remove(linea)
+        else:
+            linea[3] = cantidad
+        self.modificado = True
+
+    def eliminar(self, linea_id):
+        self._lineas.remove(self._buscar(linea_id))
+        self.modificado = True
+
+    def vaciar(self):
+        self._lineas = []
+        self.modificado = True
+
+    def persistir(self, carrito=None):
+        """
+        Vuelca estas líneas en `carrito` (o en un Carrito anónimo nuevo, al que apuntará
+        la cookie) y vacía la cookie. Las líneas que cambian quedan sin reserva: el stock
+        se reserva al confirmar el pedido con renovar_reservas.
+        """
+        with transaction.atomic():
+            if carrito is None:
+                carrito = Carrito.objects.create(cliente=None, session_key=None)
+                self.carrito_id = carrito.pk
+            existentes = {
+                (item.producto_id, item.talla): item
+                for item in carrito.itemcarrito_set.select_for_update()
+            }
+            self._productos()
+            nuevos, modificados, liberadas = [], [], []
+            for _, producto_id, talla, cantidad in self._lineas:
+                item = existentes.get((producto_id, talla))
+                if item is None:
+                    nuevos.append(ItemCarrito(carrito=carrito, producto_id=producto_id, talla=talla, cantidad=cantidad))
+                    continue
+                liberadas.append((producto_id, talla, item.cantidad_reservada))
+                item.cantidad += cantidad
+                item.reserva_expira = None
+                modificados.append(item)
+
+            devolver_stock_lineas(liberadas)
+            ItemCarrito.objects.bulk_update(modificados, ['cantidad', 'reserva_expira'])
+            ItemCarrito.objects.bulk_create(nuevos)
+            carrito.actualizar_resumen()
+        self.vaciar()
+        return carrito
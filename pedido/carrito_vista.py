@@ -0,0 +1,57 @@
+from decimal import Decimal
+
+from .stock import stock_lineas
+
+
+class LineaVista:
+    """Línea del carrito ya resuelta: la plantilla no necesita más consultas para pintarla."""
+
+    def __init__(self, id, producto, talla, cantidad, imagen, stock_maximo):
+        self.id = id
+        self.producto = producto
+        self.nombre = producto.nombre
+        self.talla = talla
+        self.cantidad = cantidad
+        self.imagen = imagen
+        # Lo que puede llegar a pedir: el stock libre más lo que la línea ya retiene
+        self.stock_maximo = stock_maximo
+        self.precio_unitario = producto.precio_final
+        self.subtotal = self.precio_unitario * cantidad
+
+
+class CarritoVista:
+    """
+    Modelo de lectura del carrito (de BD o anónimo) para el sidebar, la página del carrito
+    y el checkout. Carga líneas y productos (con su imagen principal ya copiada en
+    `imagen_url`) y stock de las tallas en dos consultas como mucho, sea cual sea el
+    número de líneas.
+    """
+
+    def __init__(self, carrito):
+        self.carrito = carrito
+        self.lineas = self._cargar(carrito) if carrito else []
+        self.num_lineas = len(self.lineas)
+        self.num_unidades = sum(linea.cantidad for linea in self.lineas)
+        self.subtotal = sum((linea.subtotal for linea in self.lineas), Decimal('0.00'))
+
+    def __bool__(self):
+        return bool(self.lineas)
+
+    @staticmethod
+    def _cargar(carrito):
+        items = list(carrito.lineas())
+        if not items:
+            return []
+
+        stock_tallas = stock_lineas([(item.producto_id, item.talla) for item in items if item.talla])
+
+        return [
+            LineaVista(
+                item.id, item.producto, item.talla, item.cantidad,
+                imagen=item.producto.imagen_url,
+                stock_maximo=(
+                    stock_tallas[(item.producto_id, item.talla)] if item.talla else item.producto.stock
+                ) + item.cantidad_reservada,
+            )
+            for item in items
+        ]
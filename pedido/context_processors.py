@@ -1,13 +1,33 @@
-from .views import _get_or_create_carrito
+from django.utils.functional import SimpleLazyObject
+
+from .middleware import get_carrito, get_carrito_vista
 import logging
 
 logger = logging.getLogger(__name__)
 
-def carrito_context(request):
-    """Añade el objeto Carrito al contexto de todas las plantillas."""
+
+def _carrito_o_none(request):
     try:
-        carrito = _get_or_create_carrito(request)
-        return {'carrito': carrito}
+        return get_carrito(request)
     except Exception as e:
         logger.error(f"Error crítico cargando el carrito (DB caída?): {e}")
-        return {'carrito': None}
\ No newline at end of file
+        return None
+
+
+def _vista_o_none(request):
+    try:
+        return get_carrito_vista(request)
+    except Exception as e:
+        logger.error(f"Error crítico cargando las líneas del carrito: {e}")
+        return None
+
+
+def carrito_context(request):
+    """
+    Añade el carrito (resumen) y su CarritoVista (líneas) al contexto de todas las
+    plantillas. Ninguno se consulta si la plantilla no lo usa.
+    """
+    return {
+        'carrito': SimpleLazyObject(lambda: _carrito_o_none(request)),
+        'carrito_vista': SimpleLazyObject(lambda: _vista_o_none(request)),
+    }
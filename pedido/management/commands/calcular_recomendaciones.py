@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pedido.recomendaciones import actualizar_recomendaciones, VECINOS
+
+
+class Command(BaseCommand):
+    help = 'Update the "frequently bought together" recommendations with the paid orders counted or cancelled since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Discard the stored counts and rescan the whole order history')
+        parser.add_argument('--neighbours', type=int, default=VECINOS, help='Recommendations kept per product')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        altas, bajas, productos = actualizar_recomendaciones(completo=options['full'], vecinos=options['neighbours'])
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{altas} orders added, {bajas} removed; {productos} products rescored in {duracion:.2f}s.'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from pedido.stock import liberar_reservas_caducadas
+
+
+class Command(BaseCommand):
+    help = 'Return the stock held by expired cart reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Cart lines released per transaction')
+
+    def handle(self, *args, **options):
+        liberadas = liberar_reservas_caducadas(lote=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {liberadas} expired cart reservations.'))
@@ -0,0 +1,75 @@
+import time
+from datetime import timedelta
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from pedido.models import Carrito, ItemCarrito
+from pedido.stock import devolver_stock_lineas
+
+
+class Command(BaseCommand):
+    help = 'Delete anonymous carts idle for too long, returning their reserved stock and clearing their sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Minimum idle age (in days) of the carts to purge')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Carts deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(days=options['days'])
+        abandonados = Carrito.objects.filter(cliente__isnull=True, fecha_actualizacion__lt=limite)
+
+        if options['dry_run']:
+            lineas = ItemCarrito.objects.filter(carrito__in=abandonados)
+            unidades = lineas.filter(reserva_expira__isnull=False).aggregate(n=Sum('cantidad'))['n'] or 0
+            self.stdout.write(self.style.WARNING(
+                f'[dry-run] {abandonados.count()} carts, {lineas.count()} lines and '
+                f'{unidades} reserved units would be purged.'
+            ))
+            return
+
+        total_carritos = total_lineas = total_sesiones = 0
+        inicio = time.monotonic()
+
+        while True:
+            inicio_lote = time.monotonic()
+            # Lotes cortos: cada transacción bloquea como mucho batch_size carritos
+            with transaction.atomic():
+                lote = list(
+                    abandonados.select_for_update(skip_locked=True)
+                    .order_by('fecha_actualizacion')
+                    .values_list('id', 'session_key')[:options['batch_size']]
+                )
+                if not lote:
+                    break
+                ids = [carrito_id for carrito_id, _ in lote]
+                claves = [clave for _, clave in lote if clave]
+
+                reservadas = (
+                    ItemCarrito.objects.filter(carrito_id__in=ids, reserva_expira__isnull=False)
+                    .values_list('producto_id', 'talla')
+                    .annotate(cantidad=Sum('cantidad'))
+                )
+                devolver_stock_lineas(reservadas)
+
+                lineas = ItemCarrito.objects.filter(carrito_id__in=ids).delete()[0]
+                Carrito.objects.filter(id__in=ids).delete()
+                sesiones = Session.objects.filter(session_key__in=claves).delete()[0]
+
+            total_carritos += len(ids)
+            total_lineas += lineas
+            total_sesiones += sesiones
+            if options['verbosity'] > 1:
+                duracion = time.monotonic() - inicio_lote
+                self.stdout.write(f'Batch of {len(ids)} carts purged in {duracion:.2f}s')
+
+        duracion = time.monotonic() - inicio
+        ritmo = total_carritos / duracion if duracion else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {total_carritos} carts, {total_lineas} lines and {total_sesiones} sessions '
+            f'in {duracion:.2f}s ({ritmo:.0f} carts/s).'
+        ))
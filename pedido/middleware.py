@@ -0,0 +1,129 @@
+from django.db import IntegrityError, transaction
+from django.utils.functional import SimpleLazyObject
+
+from client.models import Cliente
+from .models import Carrito
+from .carrito_anonimo import CarritoAnonimo, COOKIE_CARRITO
+
+
+def get_cliente(request):
+    """Devuelve el Cliente del usuario autenticado, resuelto una sola vez por petición."""
+    if not hasattr(request, '_cached_cliente'):
+        cliente = None
+        if request.user.is_authenticated:
+            cliente = Cliente.objects.filter(user=request.user).first()
+        request._cached_cliente = cliente
+    return request._cached_cliente
+
+
+def crear_carrito_cliente(cliente):
+    """
+    Crea el carrito del cliente. La restricción única impide que peticiones concurrentes
+    creen varios: si otra se adelanta, se devuelve el suyo.
+    """
+    try:
+        with transaction.atomic():
+            return Carrito.objects.create(cliente=cliente, session_key=None)
+    except IntegrityError:
+        return Carrito.objects.get(cliente=cliente)
+
+
+def get_carrito_anonimo(request):
+    """CarritoAnonimo de la cookie firmada del visitante, leído una sola vez por petición."""
+    if not hasattr(request, '_carrito_anonimo'):
+        request._carrito_anonimo = CarritoAnonimo.desde_peticion(request)
+    return request._carrito_anonimo
+
+
+def get_carrito(request):
+    """
+    Devuelve el carrito del usuario o del visitante sin crearlo.
+    Para anónimos es el CarritoAnonimo de la cookie, salvo que ya se haya persistido.
+    La consulta se hace como mucho una vez por petición y se cachea en ella.
+    """
+    if not hasattr(request, '_cached_carrito'):
+        carrito = None
+        if request.user.is_authenticated:
+            # Una sola consulta resuelve carrito y cliente a la vez
+            carrito = (
+                Carrito.objects.select_related('cliente')
+                .filter(cliente__user=request.user)
+                .first()
+            )
+            if carrito is not None and not hasattr(request, '_cached_cliente'):
+                request._cached_cliente = carrito.cliente
+        else:
+            anonimo = get_carrito_anonimo(request)
+            if anonimo.carrito_id:
+                carrito = Carrito.objects.filter(pk=anonimo.carrito_id, cliente__isnull=True).first()
+                if carrito is None:
+                    anonimo.carrito_id = None
+                    anonimo.modificado = True
+            if carrito is None and anonimo.num_lineas:
+                carrito = anonimo
+        request._cached_carrito = carrito
+    return request._cached_carrito
+
+
+def huella_carrito(request):
+    """
+    Valor que cambia cada vez que cambia el carrito que pinta la página, para los ETag:
+    la fecha de actualización del carrito de BD o la cookie firmada del anónimo.
+    """
+    carrito = get_carrito(request)
+    if isinstance(carrito, Carrito):
+        return f'{carrito.pk}:{carrito.fecha_actualizacion.timestamp()}'
+    return request.COOKIES.get(COOKIE_CARRITO, '')
+
+
+def get_carrito_vista(request):
+    """CarritoVista del carrito de la petición, construida una sola vez por petición."""
+    if not hasattr(request, '_cached_carrito_vista'):
+        from .carrito_vista import CarritoVista
+        request._cached_carrito_vista = CarritoVista(get_carrito(request))
+    return request._cached_carrito_vista
+
+
+def get_or_create_carrito(request):
+    """
+    Obtiene el carrito de la petición o lo crea si todavía no existe.
+    Para anónimos no escribe en la BD: devuelve el CarritoAnonimo (aunque esté vacío).
+    """
+    carrito = get_carrito(request)
+    if carrito is not None:
+        return carrito
+
+    if request.user.is_authenticated:
+        cliente = get_cliente(request)
+        if cliente is None:
+            cliente = Cliente.objects.create(user=request.user, direccion='', ciudad='', codigo_postal='')
+            request._cached_cliente = cliente
+            request.cliente = cliente
+        carrito = crear_carrito_cliente(cliente)
+    else:
+        carrito = get_carrito_anonimo(request)
+
+    request._cached_carrito = carrito
+    request.carrito = carrito
+    return carrito
+
+
+class CarritoMiddleware:
+    """
+    Añade a la petición `request.cliente` y `request.carrito` como objetos perezosos.
+    Solo se consulta la base de datos si una vista o plantilla los usa.
+    Al responder, reescribe la cookie del carrito anónimo si ha cambiado.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cliente = SimpleLazyObject(lambda: get_cliente(request))
+        request.carrito = SimpleLazyObject(lambda: get_carrito(request))
+        response = self.get_response(request)
+
+        anonimo = getattr(request, '_carrito_anonimo', None)
+        if anonimo is not None and anonimo.modificado:
+            anonimo.guardar(response)
+        return response
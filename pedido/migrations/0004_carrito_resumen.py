@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:09
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def rellenar_resumen(apps, schema_editor):
+    Carrito = apps.get_model('pedido', 'Carrito')
+    ItemCarrito = apps.get_model('pedido', 'ItemCarrito')
+
+    resumenes = {}
+    for item in ItemCarrito.objects.select_related('producto').iterator():
+        producto = item.producto
+        precio = producto.precio
+        if producto.oferta:
+            precio = (precio - (producto.oferta / Decimal('100')) * precio).quantize(Decimal('0.01'))
+        lineas, unidades, total = resumenes.get(item.carrito_id, (0, 0, Decimal('0.00')))
+        resumenes[item.carrito_id] = (lineas + 1, unidades + item.cantidad, total + precio * item.cantidad)
+
+    carritos = list(Carrito.objects.filter(pk__in=resumenes.keys()))
+    for carrito in carritos:
+        carrito.num_lineas, carrito.num_unidades, carrito.total = resumenes[carrito.pk]
+    Carrito.objects.bulk_update(carritos, ['num_lineas', 'num_unidades', 'total'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedido', '0003_pedido_estado_pago_pedido_stripe_client_secret_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carrito',
+            name='num_lineas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='carrito',
+            name='num_unidades',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='carrito',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.RunPython(rellenar_resumen, migrations.RunPython.noop),
+    ]
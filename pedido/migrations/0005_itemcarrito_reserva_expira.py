@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:14
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def marcar_lineas_existentes(apps, schema_editor):
+    # Las líneas anteriores ya tenían el stock descontado: se marcan como reservas
+    # caducadas para que la primera liberación devuelva ese stock.
+    ItemCarrito = apps.get_model('pedido', 'ItemCarrito')
+    ItemCarrito.objects.update(reserva_expira=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedido', '0004_carrito_resumen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemcarrito',
+            name='reserva_expira',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(marcar_lineas_existentes, migrations.RunPython.noop),
+    ]
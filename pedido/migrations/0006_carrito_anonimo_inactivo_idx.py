@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0001_initial'),
+        ('pedido', '0005_itemcarrito_reserva_expira'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(condition=models.Q(('cliente__isnull', True)), fields=['fecha_actualizacion'], name='carrito_anonimo_inactivo_idx'),
+        ),
+    ]
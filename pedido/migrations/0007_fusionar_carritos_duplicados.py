@@ -0,0 +1,94 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:24
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, F, Min
+
+
+def fusionar_duplicados(apps, schema_editor):
+    """
+    Antes de crear las restricciones únicas, junta los carritos repetidos de un mismo
+    cliente o sesión en el más antiguo. Las líneas del mismo producto y talla se suman;
+    si alguna parte no retenía stock, la línea fusionada queda sin reserva y se devuelve
+    lo que retenían las demás (se volverá a reservar al confirmar el pedido).
+    """
+    Carrito = apps.get_model('pedido', 'Carrito')
+    ItemCarrito = apps.get_model('pedido', 'ItemCarrito')
+    Product = apps.get_model('product', 'Product')
+    ProductSize = apps.get_model('product', 'ProductSize')
+
+    for campo in ('cliente_id', 'session_key'):
+        grupos = (
+            Carrito.objects.filter(**{f'{campo}__isnull': False})
+            .values(campo)
+            .annotate(n=Count('id'), destino=Min('id'))
+            .filter(n__gt=1)
+        )
+        destinos = {grupo[campo]: grupo['destino'] for grupo in grupos}
+        if not destinos:
+            continue
+
+        destino_de = {
+            carrito_id: destinos[valor]
+            for carrito_id, valor in Carrito.objects.filter(**{f'{campo}__in': destinos}).values_list('id', campo)
+        }
+
+        fusionadas = {}
+        devolver = {}
+        for item in ItemCarrito.objects.filter(carrito_id__in=destino_de).select_related('producto'):
+            clave = (destino_de[item.carrito_id], item.producto_id, item.talla)
+            linea = fusionadas.setdefault(clave, {
+                'cantidad': 0, 'reservada': 0, 'expira': item.reserva_expira, 'producto': item.producto,
+            })
+            linea['cantidad'] += item.cantidad
+            if item.reserva_expira:
+                linea['reservada'] += item.cantidad
+                linea['expira'] = max(linea['expira'] or item.reserva_expira, item.reserva_expira)
+
+        nuevas = []
+        for (carrito_id, producto_id, talla), linea in fusionadas.items():
+            expira = linea['expira']
+            if linea['reservada'] != linea['cantidad']:
+                expira = None
+                if linea['reservada']:
+                    sku = (producto_id, talla or '')
+                    devolver[sku] = devolver.get(sku, 0) + linea['reservada']
+            nuevas.append(ItemCarrito(
+                carrito_id=carrito_id, producto_id=producto_id, talla=talla,
+                cantidad=linea['cantidad'], reserva_expira=expira,
+            ))
+
+        for (producto_id, talla), cantidad in devolver.items():
+            filas = ProductSize.objects.filter(producto_id=producto_id, talla=talla) if talla else Product.objects.filter(pk=producto_id)
+            filas.update(stock=F('stock') + cantidad)
+
+        ItemCarrito.objects.filter(carrito_id__in=destino_de).delete()
+        ItemCarrito.objects.bulk_create(nuevas, batch_size=500)
+        Carrito.objects.filter(id__in=destino_de).exclude(id__in=destinos.values()).delete()
+
+        resumenes = {}
+        for (carrito_id, _, _), linea in fusionadas.items():
+            producto = linea['producto']
+            precio = producto.precio
+            if producto.oferta:
+                precio = (precio - (producto.oferta / Decimal('100')) * precio).quantize(Decimal('0.01'))
+            lineas, unidades, total = resumenes.get(carrito_id, (0, 0, Decimal('0.00')))
+            resumenes[carrito_id] = (lineas + 1, unidades + linea['cantidad'], total + precio * linea['cantidad'])
+
+        carritos = list(Carrito.objects.filter(pk__in=destinos.values()))
+        for carrito in carritos:
+            carrito.num_lineas, carrito.num_unidades, carrito.total = resumenes.get(carrito.pk, (0, 0, Decimal('0.00')))
+        Carrito.objects.bulk_update(carritos, ['num_lineas', 'num_unidades', 'total'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0001_initial'),
+        ('pedido', '0006_carrito_anonimo_inactivo_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(fusionar_duplicados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0001_initial'),
+        ('pedido', '0007_fusionar_carritos_duplicados'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='carrito',
+            constraint=models.UniqueConstraint(fields=('cliente',), name='carrito_unico_por_cliente'),
+        ),
+        migrations.AddConstraint(
+            model_name='carrito',
+            constraint=models.UniqueConstraint(fields=('session_key',), name='carrito_unico_por_sesion'),
+        ),
+    ]
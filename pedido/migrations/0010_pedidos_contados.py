@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def descartar_recuentos(apps, schema_editor):
+    # Los recuentos anteriores no dicen qué pedidos sumaron: la próxima ejecución de
+    # calcular_recomendaciones los rehace desde los pedidos que cuentan
+    apps.get_model('pedido', 'CoCompra').objects.all().delete()
+    apps.get_model('pedido', 'Recomendacion').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedido', '0009_recomendaciones'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='procesorecomendaciones',
+            name='ultimo_pedido_id',
+        ),
+        migrations.CreateModel(
+            name='PedidoContado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('productos', models.JSONField()),
+                ('pedido', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='contado', to='pedido.pedido')),
+            ],
+        ),
+        migrations.RunPython(descartar_recuentos, migrations.RunPython.noop),
+    ]
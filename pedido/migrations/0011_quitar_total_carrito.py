@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedido', '0010_pedidos_contados'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='carrito',
+            name='total',
+        ),
+    ]
@@ -1,4 +1,7 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
 
 from client.models import Cliente
 from product.models import Product
@@ -79,6 +82,12 @@ class ItemPedido(models.Model):
     def __str__(self):
         return f"{self.cantidad} x {self.producto.nombre}"
 
+# Precio de venta por cantidad de una línea del carrito, para sumarlo en la BD
+_SUBTOTAL_LINEA = ExpressionWrapper(
+    F('cantidad') * F('producto__precio_final'), output_field=DecimalField(max_digits=12, decimal_places=2),
+)
+
+
 class Carrito(models.Model):
     # El cliente ahora debe ser opcional (null=True, blank=True)
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, null=True, blank=True)
@@ -89,21 +98,52 @@ class Carrito(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
 
+    # Resumen desnormalizado para el navbar (ver actualizar_resumen). El importe no se guarda:
+    # depende del precio actual de los productos y sale de CarritoVista o de get_total()
+    num_lineas = models.PositiveIntegerField(default=0)
+    num_unidades = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Para localizar por antigüedad los carritos anónimos abandonados (purgar_carritos)
+            models.Index(
+                fields=['fecha_actualizacion'],
+                name='carrito_anonimo_inactivo_idx',
+                condition=models.Q(cliente__isnull=True),
+            ),
+        ]
+        constraints = [
+            # Un único carrito por cliente y por sesión, garantizado por la BD aunque
+            # lleguen peticiones concurrentes; sus índices únicos sirven también para buscarlos
+            models.UniqueConstraint(fields=['cliente'], name='carrito_unico_por_cliente'),
+            models.UniqueConstraint(fields=['session_key'], name='carrito_unico_por_sesion'),
+        ]
+
     def __str__(self):
         if self.cliente:
             return f"Carrito de {self.cliente}"
         return f"Carrito Anónimo ({self.session_key})"
 
+    def lineas(self):
+        """Líneas con su producto; misma interfaz que CarritoAnonimo.lineas() (ver CarritoVista)."""
+        return self.itemcarrito_set.select_related('producto').order_by('id')
+
     def get_total(self):
-        total = 0
-        for item in self.itemcarrito_set.all():
-            # CORRECCIÓN: Añadimos () después de precio_final
-            total += item.producto.precio_final * item.cantidad 
-        return total
+        return self.itemcarrito_set.aggregate(total=Sum(_SUBTOTAL_LINEA))['total'] or Decimal('0.00')
 
     def get_cantidad_items(self):
         return sum(item.cantidad for item in self.itemcarrito_set.all())
 
+    def actualizar_resumen(self):
+        """
+        Recalcula num_lineas y num_unidades a partir de las líneas y los guarda.
+        Debe llamarse dentro de la misma transacción que modifica el carrito.
+        """
+        resumen = self.itemcarrito_set.aggregate(num_lineas=Count('id'), num_unidades=Sum('cantidad'))
+        self.num_lineas = resumen['num_lineas']
+        self.num_unidades = resumen['num_unidades'] or 0
+        self.save(update_fields=['num_lineas', 'num_unidades', 'fecha_actualizacion'])
+
 class ItemCarrito(models.Model):
     carrito = models.ForeignKey(
         Carrito,
@@ -118,6 +158,56 @@ class ItemCarrito(models.Model):
     talla = models.CharField(max_length=50, blank=True, null=True)
     cantidad = models.PositiveIntegerField(default=1)
 
+    # Mientras no sea NULL la línea retiene `cantidad` unidades del stock.
+    # Al caducar, liberar_reservas_caducadas() las devuelve y lo pone a NULL.
+    reserva_expira = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    @property
+    def cantidad_reservada(self):
+        return self.cantidad if self.reserva_expira else 0
 
     def __str__(self):
-        return (f"{self.cantidad} x {self.producto.nombre}")
\ No newline at end of file
+        return (f"{self.cantidad} x {self.producto.nombre}")
+
+class CoCompra(models.Model):
+    """
+    Recuento disperso de pedidos en los que aparecen juntos dos productos (solo los pares
+    que se han dado). La fila con producto == relacionado guarda en cuántos pedidos
+    aparece el producto, para normalizar la puntuación. La mantiene pedido/recomendaciones.py.
+    """
+    producto = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    relacionado = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    veces = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'relacionado'], name='cocompra_unica'),
+        ]
+
+
+class Recomendacion(models.Model):
+    """Los mejores vecinos de cada producto por co-compra, ya ordenados para la ficha."""
+    producto = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recomendaciones')
+    relacionado = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    posicion = models.PositiveSmallIntegerField()
+    puntuacion = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Su índice único sirve para leer las recomendaciones de un producto en orden
+            models.UniqueConstraint(fields=['producto', 'posicion'], name='recomendacion_unica_por_posicion'),
+        ]
+
+
+class PedidoContado(models.Model):
+    """
+    Pedido ya sumado a CoCompra, con los productos que se sumaron, para restarlos si deja
+    de contar (se cancela o se borra). Lo mantiene pedido/recomendaciones.py.
+    """
+    pedido = models.OneToOneField(Pedido, on_delete=models.SET_NULL, null=True, related_name='contado')
+    productos = models.JSONField()
+
+
+class ProcesoRecomendaciones(models.Model):
+    """Fila única que bloquea las ejecuciones de pedido/recomendaciones.py mientras dura una."""
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
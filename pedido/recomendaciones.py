@@ -0,0 +1,151 @@
+"""
+"Comprados juntos habitualmente": vecinos de cada producto según el histórico de pedidos.
+
+Cuentan como compra los pedidos pagados y no cancelados. Cada pedido contado queda
+registrado en PedidoContado con sus productos, así que cada ejecución:
+
+- suma a CoCompra (recuento disperso: solo existen los pares que se han dado) los
+  pedidos que cuentan y aún no están registrados, sin depender del orden de sus ids
+  ni de cuándo se confirmó su transacción;
+- resta los registrados que ya no cuentan (cancelados o borrados).
+
+Después vuelve a puntuar con la similitud del coseno, veces_juntos / sqrt(pedidos_a * pedidos_b),
+los productos cuyos recuentos han cambiado y todos los que tienen alguno de ellos como
+vecino (su puntuación depende de esos recuentos), y guarda sus mejores vecinos en
+Recomendacion, que la ficha de producto lee con una sola consulta por índice.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from product.detalle import invalidar as invalidar_fichas
+from .models import Pedido, ItemPedido, CoCompra, Recomendacion, ProcesoRecomendaciones, PedidoContado
+
+VECINOS = 8
+
+
+def pedidos_que_cuentan():
+    """Pedidos que cuentan como compra: pagados y no cancelados."""
+    return Pedido.objects.filter(estado_pago='pagado').exclude(estado=Pedido.EstadoPedido.CANCELADO)
+
+
+def _sumar(pares, productos, signo):
+    """Co-apariciones de un pedido en ambos sentidos, más la diagonal, con `signo` (+1 o -1)."""
+    for producto_id in productos:
+        pares[(producto_id, producto_id)] += signo
+    for a, b in combinations(productos, 2):
+        pares[(a, b)] += signo
+        pares[(b, a)] += signo
+
+
+def _altas(pares):
+    """Suma los pedidos que cuentan y no están registrados, y los registra. Devuelve cuántos."""
+    lineas = (
+        ItemPedido.objects.filter(pedido__in=pedidos_que_cuentan().filter(contado__isnull=True))
+        .order_by('pedido_id')
+        .values_list('pedido_id', 'producto_id')
+    )
+    registros = []
+    for pedido_id, filas in groupby(lineas.iterator(), key=lambda fila: fila[0]):
+        productos = sorted({producto_id for _, producto_id in filas})
+        _sumar(pares, productos, 1)
+        registros.append(PedidoContado(pedido_id=pedido_id, productos=productos))
+    PedidoContado.objects.bulk_create(registros, batch_size=500)
+    return len(registros)
+
+
+def _bajas(pares):
+    """Resta los pedidos registrados que ya no cuentan y borra su registro. Devuelve cuántos."""
+    registros = list(
+        PedidoContado.objects.filter(Q(pedido__isnull=True) | ~Q(pedido__in=pedidos_que_cuentan()))
+        .values_list('pk', 'productos')
+    )
+    for _, productos in registros:
+        _sumar(pares, productos, -1)
+    PedidoContado.objects.filter(pk__in=[pk for pk, _ in registros]).delete()
+    return len(registros)
+
+
+def _acumular(pares):
+    existentes = {
+        (fila.producto_id, fila.relacionado_id): fila
+        for fila in CoCompra.objects.filter(producto_id__in={a for a, _ in pares})
+    }
+    nuevas, cambiadas, vacias = [], [], []
+    for (a, b), veces in pares.items():
+        if not veces:
+            continue
+        fila = existentes.get((a, b))
+        if fila:
+            fila.veces += veces
+            (cambiadas if fila.veces > 0 else vacias).append(fila)
+        elif veces > 0:
+            nuevas.append(CoCompra(producto_id=a, relacionado_id=b, veces=veces))
+    CoCompra.objects.filter(pk__in=[fila.pk for fila in vacias]).delete()
+    CoCompra.objects.bulk_update(cambiadas, ['veces'], batch_size=500)
+    CoCompra.objects.bulk_create(nuevas, batch_size=500)
+
+
+def _puntuar(productos, vecinos):
+    """Recalcula de golpe los `vecinos` mejores de cada producto de `productos`."""
+    filas = list(
+        CoCompra.objects.filter(producto_id__in=productos)
+        .exclude(relacionado_id=F('producto_id'))
+        .values_list('producto_id', 'relacionado_id', 'veces')
+    )
+    implicados = set(productos) | {b for _, b, _ in filas}
+    apariciones = dict(
+        CoCompra.objects.filter(producto_id__in=implicados, relacionado_id=F('producto_id'))
+        .values_list('producto_id', 'veces')
+    )
+
+    candidatos = defaultdict(list)
+    for a, b, veces in filas:
+        candidatos[a].append((veces / math.sqrt(apariciones[a] * apariciones[b]), b))
+
+    recomendaciones = [
+        Recomendacion(producto_id=a, relacionado_id=b, posicion=posicion, puntuacion=puntuacion)
+        for a, lista in candidatos.items()
+        # A igual puntuación, primero el producto más antiguo
+        for posicion, (puntuacion, b) in enumerate(heapq.nlargest(vecinos, lista, key=lambda c: (c[0], -c[1])))
+    ]
+    Recomendacion.objects.filter(producto_id__in=productos).delete()
+    Recomendacion.objects.bulk_create(recomendaciones, batch_size=500)
+
+
+def actualizar_recomendaciones(completo=False, vecinos=VECINOS):
+    """
+    Incorpora los pedidos que han empezado o dejado de contar (o todo el histórico si
+    `completo`) y devuelve (pedidos sumados, pedidos restados, productos repuntuados).
+    """
+    with transaction.atomic():
+        # El bloqueo evita que dos ejecuciones simultáneas cuenten los mismos pedidos
+        proceso, _ = ProcesoRecomendaciones.objects.select_for_update().get_or_create(pk=1)
+        if completo:
+            CoCompra.objects.all().delete()
+            Recomendacion.objects.all().delete()
+            PedidoContado.objects.all().delete()
+
+        pares = Counter()
+        bajas = _bajas(pares)
+        altas = _altas(pares)
+        productos = {a for (a, _), veces in pares.items() if veces}
+        if productos:
+            _acumular(pares)
+            # La puntuación de un par depende de los pedidos de ambos productos: si cambian
+            # los de uno, cambia también la de todos los que lo tienen como vecino
+            diagonal = {a for (a, b), veces in pares.items() if veces and a == b}
+            productos |= set(
+                CoCompra.objects.filter(relacionado_id__in=diagonal).values_list('producto_id', flat=True)
+            )
+            _puntuar(productos, vecinos)
+        proceso.save()
+
+    if productos:
+        # Las fichas cacheadas de estos productos muestran sus relacionados
+        invalidar_fichas(productos)
+    return altas, bajas, len(productos)
@@ -0,0 +1,38 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from client.models import Cliente
+from .models import Carrito
+from .middleware import get_carrito_anonimo, crear_carrito_cliente
+from .stock import fusionar_carritos
+
+
+@receiver(user_logged_in)
+def volcar_carrito_anonimo(sender, request, user, **kwargs):
+    """
+    Al iniciar sesión, el carrito anónimo pasa al de la cuenta: tanto el Carrito ya
+    persistido al que apunta la cookie como las líneas que todavía viven en ella.
+    """
+    if request is None:
+        return
+    anonimo = get_carrito_anonimo(request)
+    if not anonimo.num_lineas and not anonimo.carrito_id:
+        return
+
+    cliente, _ = Cliente.objects.get_or_create(
+        user=user, defaults={'direccion': '', 'ciudad': '', 'codigo_postal': ''}
+    )
+    carrito = Carrito.objects.filter(cliente=cliente).first() or crear_carrito_cliente(cliente)
+
+    if anonimo.carrito_id:
+        origen = Carrito.objects.filter(pk=anonimo.carrito_id, cliente__isnull=True).first()
+        if origen is not None:
+            fusionar_carritos(origen, carrito)
+        anonimo.carrito_id = None
+        anonimo.modificado = True
+    if anonimo.num_lineas:
+        anonimo.persistir(carrito)
+
+    # Lo cacheado en la petición corresponde todavía al visitante anónimo
+    for atributo in ('_cached_carrito', '_cached_carrito_vista', '_cached_cliente'):
+        request.__dict__.pop(atributo, None)
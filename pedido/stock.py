@@ -0,0 +1,263 @@
+from collections import defaultdict
+from datetime import timedelta
+from functools import reduce
+import operator
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Case, When, Value, IntegerField
+from django.utils import timezone
+
+from product.models import Product, ProductSize
+from product.tallas import actualizar_tallas_disponibles
+from .models import Carrito, ItemCarrito
+
+
+def _filas_stock(producto_id, talla):
+    """Fila que guarda el stock de una línea: la de su talla o, sin talla, la del producto."""
+    if talla:
+        return ProductSize.objects.filter(producto_id=producto_id, talla=talla)
+    return Product.objects.filter(pk=producto_id)
+
+
+def _sin_fila_de_talla(producto_id, talla):
+    """
+    True si la línea tiene talla pero esta no tiene fila en ProductSize (se borró o nunca
+    existió): como hacía _get_stock_object, su stock se lleva entonces en el producto.
+    """
+    return bool(talla) and not _filas_stock(producto_id, talla).exists()
+
+
+def orden_bloqueo(linea):
+    """
+    Clave de orden común para operaciones de varias líneas: primero filas de Product
+    y después de ProductSize, cada una por su clave. Tomar siempre las filas en el
+    mismo orden evita interbloqueos entre peticiones concurrentes.
+    """
+    return (bool(linea.talla), linea.producto_id, linea.talla or '')
+
+
+def stock_disponible(producto_id, talla):
+    return _filas_stock(producto_id, talla).values_list('stock', flat=True).first() or 0
+
+
+def reservar_stock(producto_id, talla, cantidad):
+    """
+    Descuenta `cantidad` unidades con un único UPDATE condicionado a que haya stock
+    (`stock = stock - n WHERE stock >= n`). Devuelve False si no había suficiente.
+    """
+    if cantidad <= 0:
+        return True
+    actualizadas = _filas_stock(producto_id, talla).filter(stock__gte=cantidad).update(stock=F('stock') - cantidad)
+    if talla and actualizadas:
+        actualizar_tallas_disponibles([producto_id])
+    elif not actualizadas and _sin_fila_de_talla(producto_id, talla):
+        actualizadas = _filas_stock(producto_id, None).filter(stock__gte=cantidad).update(stock=F('stock') - cantidad)
+    return actualizadas == 1
+
+
+def devolver_stock(producto_id, talla, cantidad):
+    """Devuelve `cantidad` unidades al stock con un UPDATE atómico (`stock = stock + n`)."""
+    if cantidad > 0:
+        actualizadas = _filas_stock(producto_id, talla).update(stock=F('stock') + cantidad)
+        if talla and actualizadas:
+            actualizar_tallas_disponibles([producto_id])
+        elif talla:
+            # La talla ya no tiene fila: las unidades vuelven al producto en vez de perderse
+            _filas_stock(producto_id, None).update(stock=F('stock') + cantidad)
+
+
+def _agrupar_por_sku(lineas):
+    """Suma las cantidades de líneas `(producto_id, talla, cantidad)` por fila de Product y de ProductSize."""
+    por_producto = defaultdict(int)
+    por_talla = defaultdict(int)
+    for producto_id, talla, cantidad in lineas:
+        if cantidad <= 0:
+            continue
+        if talla:
+            por_talla[(producto_id, talla)] += cantidad
+        else:
+            por_producto[producto_id] += cantidad
+    return por_producto, por_talla
+
+
+def _sumar_stock_lineas(lineas, signo, condicionado=False):
+    """
+    Suma `signo * cantidad` al stock de cada SKU con un solo UPDATE ... CASE por tabla.
+    Con `condicionado`, cada fila solo se toca si tiene stock suficiente (`stock >= n`).
+    Devuelve (filas actualizadas, filas esperadas).
+    """
+    por_producto, por_talla = _agrupar_por_sku(lineas)
+    actualizadas = 0
+
+    if por_talla:
+        # Las tallas sin fila en ProductSize llevan su stock en el producto
+        con_fila = set(ProductSize.objects.filter(
+            reduce(operator.or_, (Q(producto_id=p, talla=t) for p, t in por_talla))
+        ).values_list('producto_id', 'talla'))
+        for clave in [clave for clave in por_talla if clave not in con_fila]:
+            por_producto[clave[0]] += por_talla.pop(clave)
+
+    if por_producto:
+        claves = sorted(por_producto)
+        if condicionado:
+            filtro = reduce(operator.or_, (Q(pk=pk, stock__gte=por_producto[pk]) for pk in claves))
+        else:
+            filtro = Q(pk__in=claves)
+        actualizadas += Product.objects.filter(filtro).update(stock=F('stock') + Case(
+            *[When(pk=pk, then=Value(signo * por_producto[pk])) for pk in claves],
+            default=Value(0), output_field=IntegerField(),
+        ))
+
+    if por_talla:
+        claves = sorted(por_talla)
+        condicion = (lambda n: {'stock__gte': n}) if condicionado else (lambda n: {})
+        actualizadas += ProductSize.objects.filter(
+            reduce(operator.or_, (Q(producto_id=p, talla=t, **condicion(por_talla[(p, t)])) for p, t in claves))
+        ).update(stock=F('stock') + Case(
+            *[When(producto_id=p, talla=t, then=Value(signo * por_talla[(p, t)])) for p, t in claves],
+            default=Value(0), output_field=IntegerField(),
+        ))
+        # La máscara de tallas con stock de Product no se entera sola de estos UPDATE
+        actualizar_tallas_disponibles({p for p, _ in claves})
+
+    return actualizadas, len(por_producto) + len(por_talla)
+
+
+def devolver_stock_lineas(lineas):
+    """
+    Devuelve el stock de muchas líneas `(producto_id, talla, cantidad)` a la vez:
+    agrupa por SKU y lanza un solo UPDATE ... CASE por tabla, sea cual sea el número de líneas.
+    """
+    _sumar_stock_lineas(lineas, 1)
+
+
+def reservar_stock_lineas(lineas):
+    """
+    Versión por lotes de reservar_stock: un UPDATE ... CASE condicionado por tabla.
+    Devuelve False si a algún SKU le falta stock; como el resto sí se habrá descontado,
+    debe llamarse dentro de una transacción que se deshace en ese caso.
+    """
+    actualizadas, esperadas = _sumar_stock_lineas(lineas, -1, condicionado=True)
+    return actualizadas == esperadas
+
+
+def stock_lineas(claves):
+    """Stock actual de varios SKU `(producto_id, talla)` con una consulta por tabla."""
+    sin_talla = [p for p, t in claves if not t]
+    con_talla = [(p, t) for p, t in claves if t]
+    productos = dict(Product.objects.filter(pk__in=sin_talla).values_list('pk', 'stock')) if sin_talla else {}
+    tallas = {}
+    if con_talla:
+        filas = ProductSize.objects.filter(reduce(operator.or_, (Q(producto_id=p, talla=t) for p, t in con_talla)))
+        tallas = {(p, t): n for p, t, n in filas.values_list('producto_id', 'talla', 'stock')}
+    return {(p, t): tallas.get((p, t), 0) if t else productos.get(p, 0) for p, t in claves}
+
+
+# --- Reservas de stock de las líneas del carrito ---
+
+def nueva_expiracion():
+    return timezone.now() + timedelta(minutes=settings.CARRITO_RESERVA_MINUTOS)
+
+
+def ajustar_linea(item, nueva_cantidad):
+    """
+    Deja la línea (ya bloqueada con select_for_update) con `nueva_cantidad` unidades
+    reservadas hasta nueva_expiracion(). Solo reserva o devuelve la diferencia con lo
+    que ya retenía. Devuelve False, sin tocar nada, si no hay stock suficiente.
+    """
+    diferencia = nueva_cantidad - item.cantidad_reservada
+    if diferencia > 0:
+        if not reservar_stock(item.producto_id, item.talla, diferencia):
+            return False
+    else:
+        devolver_stock(item.producto_id, item.talla, -diferencia)
+
+    item.cantidad = nueva_cantidad
+    item.reserva_expira = nueva_expiracion()
+    item.save(update_fields=['cantidad', 'reserva_expira'])
+    return True
+
+
+def renovar_reservas(carrito):
+    """
+    Prolonga las reservas del carrito y vuelve a reservar las líneas cuya reserva se
+    liberó. Devuelve las líneas que no se han podido reservar por falta de stock.
+    """
+    expira = nueva_expiracion()
+    fallidas = []
+    with transaction.atomic():
+        carrito.itemcarrito_set.filter(reserva_expira__isnull=False).update(reserva_expira=expira)
+        sin_reserva = carrito.itemcarrito_set.select_for_update().filter(reserva_expira__isnull=True)
+        for item in sorted(sin_reserva, key=orden_bloqueo):
+            if reservar_stock(item.producto_id, item.talla, item.cantidad):
+                item.reserva_expira = expira
+                item.save(update_fields=['reserva_expira'])
+            else:
+                fallidas.append(item)
+    return fallidas
+
+
+def fusionar_carritos(origen, destino):
+    """
+    Pasa las líneas de `origen` a `destino` y borra `origen` en una sola transacción, con
+    las mismas consultas sea cual sea el número de líneas. Las del mismo producto y talla
+    se suman: si ambas retenían stock se conserva la reserva; si no, la línea fusionada
+    queda sin reserva y se devuelve lo retenido (se reservará al confirmar el pedido).
+    """
+    with transaction.atomic():
+        items = list(ItemCarrito.objects.select_for_update().filter(carrito_id__in=[origen.pk, destino.pk]))
+        existentes = {(item.producto_id, item.talla): item for item in items if item.carrito_id == destino.pk}
+
+        movidos, modificados, devolver = [], [], []
+        for item in items:
+            if item.carrito_id != origen.pk:
+                continue
+            otro = existentes.get((item.producto_id, item.talla))
+            if otro is None:
+                movidos.append(item.id)
+                continue
+            if item.reserva_expira and otro.reserva_expira:
+                otro.reserva_expira = max(item.reserva_expira, otro.reserva_expira)
+            else:
+                devolver.append((item.producto_id, item.talla, item.cantidad_reservada))
+                devolver.append((otro.producto_id, otro.talla, otro.cantidad_reservada))
+                otro.reserva_expira = None
+            otro.cantidad += item.cantidad
+            modificados.append(otro)
+
+        devolver_stock_lineas(devolver)
+        ItemCarrito.objects.filter(id__in=movidos).update(carrito=destino)
+        ItemCarrito.objects.bulk_update(modificados, ['cantidad', 'reserva_expira'])
+        ItemCarrito.objects.filter(carrito=origen).delete()
+        Carrito.objects.filter(pk=origen.pk).delete()
+        destino.actualizar_resumen()
+    return destino
+
+
+def liberar_reservas_caducadas(lote=500):
+    """
+    Devuelve al stock las reservas caducadas. Cada lote son tres sentencias: un UPDATE
+    sobre Product, otro sobre ProductSize y otro que marca las líneas como no reservadas.
+    Devuelve el número de líneas liberadas.
+    """
+    liberadas = 0
+    while True:
+        with transaction.atomic():
+            caducadas = list(
+                ItemCarrito.objects.select_for_update(skip_locked=True)
+                .filter(reserva_expira__lte=timezone.now())
+                .values_list('id', 'producto_id', 'talla', 'cantidad')[:lote]
+            )
+            if not caducadas:
+                return liberadas
+            devolver_stock_lineas((producto_id, talla, cantidad) for _, producto_id, talla, cantidad in caducadas)
+            ItemCarrito.objects.filter(id__in=[c[0] for c in caducadas]).update(reserva_expira=None)
+        liberadas += len(caducadas)
+
+
+def liberar_reservas_si_toca():
+    """Liberación perezosa al consultar stock: como mucho una vez cada CARRITO_LIBERACION_SEGUNDOS."""
+    if cache.add('pedido:liberar_reservas', True, timeout=settings.CARRITO_LIBERACION_SEGUNDOS):
+        liberar_reservas_caducadas()
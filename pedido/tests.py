@@ -1,11 +1,27 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, IntegrityError, transaction
 from django.urls import reverse
 from decimal import Decimal
+import math
+from datetime import timedelta
+from io import StringIO
+import json
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
 
 from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
 
-from product.models import Product
-from pedido.models import Carrito, ItemCarrito
+from product.models import Product, ProductSize, ProductImage
+from pedido.models import Carrito, ItemCarrito, Pedido, ItemPedido, CoCompra, Recomendacion
+from pedido.recomendaciones import actualizar_recomendaciones
+from pedido.stock import devolver_stock, devolver_stock_lineas, reservar_stock
+from pedido.middleware import crear_carrito_cliente
+from pedido.carrito_anonimo import CarritoAnonimo, SALT_CARRITO
 
 
 class PedidoModelAndViewTests(TestCase):
@@ -33,29 +49,436 @@ class PedidoModelAndViewTests(TestCase):
 		self.assertEqual(carrito.get_total(), expected_total)
 		self.assertEqual(carrito.get_cantidad_items(), 2)
 
-	def test_agregar_al_carrito_creates_item_and_reduces_stock(self):
-		# Ensure session exists for anonymous carrito
-		session = self.client.session
-		session.save()
-		session_key = session.session_key
-
+	def test_agregar_al_carrito_anonimo_queda_en_cookie(self):
 		url = reverse('agregar_al_carrito', args=[self.product.id])
 
 		# POST(quantity=3) and ask to redirect to cart
 		response = self.client.post(url, {'cantidad': '3', 'redirect_to_cart': '1'})
-
-		# should redirect to carrito view
 		self.assertEqual(response.status_code, 302)
 
-		# There should be a carrito linked to the session
-		carrito = Carrito.objects.filter(session_key=session_key).first()
-		self.assertIsNotNone(carrito)
+		# Anonymous lines live in the signed cookie: nothing is written to the DB
+		self.assertIn('carrito', response.cookies)
+		self.assertFalse(Carrito.objects.exists())
+		self.assertFalse(Session.objects.exists())
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 10)
+
+		response = self.client.get(reverse('carrito_compra'))
+		self.assertEqual(response.context['cantidad_items'], 3)
+		self.assertEqual(response.context['subtotal'], self.product.precio_final * 3)
+
+		# A tampered cookie is simply ignored
+		self.client.cookies['carrito'] = 'manipulada'
+		response = self.client.get(reverse('carrito_compra'))
+		self.assertEqual(response.context['cantidad_items'], 0)
+
+	def test_carrito_anonimo_usa_precio_actual_y_olvida_productos_borrados(self):
+		otro = Product.objects.create(nombre='Zapato Borrado', precio=Decimal('20.00'), stock=5)
+		self.client.post(reverse('agregar_al_carrito', args=[self.product.id]), {'cantidad': '2'})
+		self.client.post(reverse('agregar_al_carrito', args=[otro.id]), {'cantidad': '1'})
+		self.product.oferta = Decimal('10')
+		self.product.save()
+		otro.delete()
+
+		data = self.client.get(reverse('carrito_fragmento')).json()
+		self.assertEqual((data['num_lineas'], data['num_unidades'], data['total']), (1, 2, '90.00'))
+		response = self.client.get(reverse('carrito_compra'))
+		self.assertEqual(response.context['subtotal'], Decimal('90.00'))
+
+	def test_resumen_del_carrito_anonimo_no_consulta_productos(self):
+		# The navbar badge reads the summary on every page: it comes from the cookie alone
+		carrito = CarritoAnonimo({'l': [[1, self.product.id, '40', 2], [2, self.product.id, '41', 1]], 'n': 3})
+		with self.assertNumQueries(0):
+			self.assertEqual((carrito.num_lineas, carrito.num_unidades), (2, 3))
+		self.assertEqual(carrito.get_total(), self.product.precio_final * 3)
+
+	def test_carrito_anonimo_pasa_a_la_cuenta_al_iniciar_sesion(self):
+		self.client.post(reverse('agregar_al_carrito', args=[self.product.id]), {'cantidad': '2'})
+		self.client.post(reverse('client-login'), {'username': 'cliente1', 'password': 'testpass'})
+
+		carrito = Carrito.objects.get(cliente=self.user.cliente)
+		self.assertEqual(carrito.num_unidades, 2)
+		self.assertEqual(self.client.cookies['carrito'].value, '')
+
+		# The stock is reserved when the order is confirmed
+		self.client.post(reverse('crear_pedido'), {
+			'nombre': 'U', 'apellidos': 'Uno', 'email': 'cliente1@test.com', 'direccion': 'Calle 1',
+			'ciudad': 'Sevilla', 'codigo_postal': '41001', 'telefono': '600000000',
+		})
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 8)
+
+
+	def test_navegar_como_anonimo_no_crea_carrito(self):
+		response = self.client.get(reverse('product:product_list'))
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse(Carrito.objects.exists())
+
+	def test_carrito_se_resuelve_una_vez_por_peticion(self):
+		carrito = Carrito.objects.create(cliente=self.user.cliente)
+		ItemCarrito.objects.create(carrito=carrito, producto=self.product, cantidad=1)
+		self.client.login(username='cliente1', password='testpass')
+
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(reverse('carrito_compra'))
+		self.assertEqual(response.status_code, 200)
+
+		consultas_carrito = [
+			q['sql'] for q in ctx.captured_queries
+			if 'FROM "pedido_carrito"' in q['sql']
+		]
+		self.assertEqual(len(consultas_carrito), 1)
+
+	def test_resumen_del_carrito_se_mantiene_en_cada_cambio(self):
+		self.client.login(username='cliente1', password='testpass')
+		self.client.post(reverse('agregar_al_carrito', args=[self.product.id]), {'cantidad': '2'})
+
+		carrito = Carrito.objects.get(cliente=self.user.cliente)
+		self.assertEqual(carrito.num_lineas, 1)
+		self.assertEqual(carrito.num_unidades, 2)
 
-		item = ItemCarrito.objects.filter(carrito=carrito, producto=self.product).first()
-		self.assertIsNotNone(item)
-		self.assertEqual(item.cantidad, 3)
+		item = carrito.itemcarrito_set.get()
+		self.client.post(reverse('actualizar_cantidad_carrito', args=[item.id]), {'cantidad': '3'})
+		carrito.refresh_from_db()
+		self.assertEqual(carrito.num_unidades, 3)
+
+		self.client.post(reverse('vaciar_carrito'))
+		carrito.refresh_from_db()
+		self.assertEqual((carrito.num_lineas, carrito.num_unidades), (0, 0))
+
+	def test_fragmento_del_carrito_devuelve_lineas_y_contadores(self):
+		self.client.login(username='cliente1', password='testpass')
+		response = self.client.post(
+			reverse('agregar_al_carrito', args=[self.product.id]),
+			{'cantidad': '2'},
+			HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+		)
+		data = response.json()
+		self.assertTrue(data['success'])
+		self.assertEqual(data['num_lineas'], 1)
+		self.assertIn('Zapato Test', data['items_html'])
+
+		response = self.client.get(reverse('carrito_fragmento'))
+		self.assertEqual(response.status_code, 200)
+		data = response.json()
+		self.assertEqual(data['num_unidades'], 2)
+		self.assertEqual(data['total'], '100.00')
+		self.assertIn('Finalizar Compra', data['footer_html'])
+
+	def test_fragmento_usa_el_precio_actual(self):
+		self.client.login(username='cliente1', password='testpass')
+		self.client.post(reverse('agregar_al_carrito', args=[self.product.id]), {'cantidad': '2'})
+		self.product.oferta = Decimal('10')
+		self.product.save()
+
+		data = self.client.get(reverse('carrito_fragmento')).json()
+		self.assertEqual(data['total'], '90.00')
+		self.assertIn('90,00', data['footer_html'])
+
+	def test_reserva_de_stock_es_condicional(self):
+		self.assertTrue(reservar_stock(self.product.id, None, 10))
+		self.assertFalse(reservar_stock(self.product.id, None, 1))
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 0)
+
+	def test_stock_de_talla_sin_fila_vuelve_al_producto(self):
+		talla = ProductSize.objects.create(producto=self.product, talla='42', stock=3)
+		self.assertTrue(reservar_stock(self.product.id, '42', 2))
+		talla.delete()
+
+		# The size row is gone: returned units go to the product instead of being lost
+		devolver_stock(self.product.id, '42', 2)
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 12)
+		devolver_stock_lineas([(self.product.id, '42', 1), (self.product.id, None, 1)])
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 14)
+		self.assertTrue(reservar_stock(self.product.id, '42', 14))
+		self.assertFalse(reservar_stock(self.product.id, '42', 1))
+
+	def test_actualizar_cantidad_sin_stock_no_modifica_nada(self):
+		self.client.login(username='cliente1', password='testpass')
+		self.client.post(reverse('agregar_al_carrito', args=[self.product.id]), {'cantidad': '4'})
+		item = ItemCarrito.objects.get(carrito__cliente=self.user.cliente)
+
+		response = self.client.post(
+			reverse('actualizar_cantidad_carrito', args=[item.id]),
+			{'cantidad': '11'},
+			HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+		)
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(response.json()['max_qty'], 10)
+
+		item.refresh_from_db()
+		self.product.refresh_from_db()
+		self.assertEqual(item.cantidad, 4)
+		self.assertEqual(self.product.stock, 6)
+
+	def test_reservas_caducadas_se_liberan_en_bloque(self):
+		self.client.login(username='cliente1', password='testpass')
+		self.client.post(reverse('agregar_al_carrito', args=[self.product.id]), {'cantidad': '4'})
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 6)
+
+		ItemCarrito.objects.update(reserva_expira=timezone.now() - timedelta(minutes=1))
+		call_command('liberar_reservas', stdout=StringIO())
+
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 10)
+		item = ItemCarrito.objects.get()
+		self.assertIsNone(item.reserva_expira)
+		self.assertEqual(item.cantidad, 4)
 
-		# Product stock should be reduced
+		# Al volver a tocar la línea se reserva de nuevo la cantidad completa
+		self.client.post(reverse('actualizar_cantidad_carrito', args=[item.id]), {'cantidad': '5'})
 		self.product.refresh_from_db()
-		self.assertEqual(self.product.stock, 7)
+		self.assertEqual(self.product.stock, 5)
+		item.refresh_from_db()
+		self.assertIsNotNone(item.reserva_expira)
+
+	def test_purgar_carritos_anonimos_abandonados(self):
+		session = self.client.session
+		session.save()
+		carrito = Carrito.objects.create(session_key=session.session_key)
+		ItemCarrito.objects.create(carrito=carrito, producto=self.product, cantidad=3, reserva_expira=timezone.now())
+		Product.objects.filter(pk=self.product.pk).update(stock=7)
+		Carrito.objects.filter(pk=carrito.pk).update(fecha_actualizacion=timezone.now() - timedelta(days=30))
+		carrito_usuario = Carrito.objects.create(cliente=self.user.cliente)
+		Carrito.objects.filter(pk=carrito_usuario.pk).update(fecha_actualizacion=timezone.now() - timedelta(days=30))
+
+		call_command('purgar_carritos', '--dry-run', stdout=StringIO())
+		self.assertTrue(Carrito.objects.filter(pk=carrito.pk).exists())
+
+		call_command('purgar_carritos', '--days', '7', stdout=StringIO())
+		self.assertFalse(Carrito.objects.filter(pk=carrito.pk).exists())
+		self.assertFalse(ItemCarrito.objects.exists())
+		self.assertFalse(Session.objects.filter(session_key=session.session_key).exists())
+		self.assertTrue(Carrito.objects.filter(pk=carrito_usuario.pk).exists())
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 10)
+
+	def test_lote_de_operaciones_se_aplica_de_una_vez(self):
+		bota = Product.objects.create(nombre='Bota', precio=Decimal('20.00'), stock=0, disponible=True)
+		talla = ProductSize.objects.create(producto=bota, talla='42', stock=5)
+		self.client.login(username='cliente1', password='testpass')
+		url = reverse('carrito_lote')
+
+		response = self.client.post(url, {'operaciones': [
+			{'producto_id': self.product.id, 'cantidad': 2},
+			{'producto_id': bota.id, 'talla_id': talla.id, 'cantidad': 3},
+		]}, content_type='application/json')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.json()['num_unidades'], 5)
+
+		items = {item.producto_id: item for item in ItemCarrito.objects.all()}
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.post(url, {'operaciones': [
+				{'item_id': items[self.product.id].id, 'cantidad': 4},
+				{'item_id': items[bota.id].id, 'cantidad': 0},
+			]}, content_type='application/json')
+		self.assertEqual(response.json()['num_lineas'], 1)
+		actualizaciones_stock = [
+			q['sql'] for q in ctx.captured_queries
+			if q['sql'].startswith('UPDATE') and 'stock' in q['sql']
+		]
+		# One UPDATE ... CASE per stock table, plus one refreshing the products' size mask
+		self.assertEqual(len(actualizaciones_stock), 3)
+		self.assertEqual(len([sql for sql in actualizaciones_stock if '"tallas_disponibles"' in sql]), 1)
+
+		self.product.refresh_from_db()
+		talla.refresh_from_db()
+		self.assertEqual((self.product.stock, talla.stock), (6, 5))
+
+		# If one line lacks stock, none of the operations is applied
+		response = self.client.post(url, {'operaciones': [
+			{'item_id': items[self.product.id].id, 'cantidad': 1},
+			{'producto_id': bota.id, 'talla_id': talla.id, 'cantidad': 6},
+		]}, content_type='application/json')
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(response.json()['num_unidades'], 4)
+		self.product.refresh_from_db()
+		talla.refresh_from_db()
+		self.assertEqual((self.product.stock, talla.stock), (6, 5))
+
+	def test_lote_de_operaciones_en_carrito_anonimo(self):
+		url = reverse('carrito_lote')
+		self.client.post(url, {'operaciones': [{'producto_id': self.product.id, 'cantidad': 3}]}, content_type='application/json')
+		response = self.client.post(url, {'operaciones': [{'item_id': 1, 'cantidad': 11}]}, content_type='application/json')
+		self.assertEqual(response.status_code, 400)
+		response = self.client.post(url, {'operaciones': [{'item_id': 1, 'cantidad': 5}]}, content_type='application/json')
+		self.assertEqual(response.json()['num_unidades'], 5)
+		self.assertFalse(Carrito.objects.exists())
+
+	def test_vaciar_carrito_devuelve_el_stock_en_bloque(self):
+		botas = [Product.objects.create(nombre=f'Bota {n}', precio=Decimal('20.00'), stock=0) for n in range(3)]
+		tallas = [ProductSize.objects.create(producto=bota, talla='40', stock=5) for bota in botas]
+		self.client.login(username='cliente1', password='testpass')
+		operaciones = [{'producto_id': self.product.id, 'cantidad': 2}] + [
+			{'producto_id': talla.producto_id, 'talla_id': talla.id, 'cantidad': 2} for talla in tallas
+		]
+		self.client.post(reverse('carrito_lote'), {'operaciones': operaciones}, content_type='application/json')
+
+		with CaptureQueriesContext(connection) as ctx:
+			self.client.post(reverse('vaciar_carrito'))
+		actualizaciones_stock = [
+			q['sql'] for q in ctx.captured_queries
+			if q['sql'].startswith('UPDATE') and 'stock' in q['sql']
+		]
+		# One UPDATE ... CASE per stock table, plus one refreshing the products' size mask
+		self.assertEqual(len(actualizaciones_stock), 3)
+		self.assertEqual(len([sql for sql in actualizaciones_stock if '"tallas_disponibles"' in sql]), 1)
+
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 10)
+		self.assertEqual([t.stock for t in ProductSize.objects.order_by('id')], [5, 5, 5])
+		self.assertFalse(ItemCarrito.objects.exists())
+
+	def test_un_solo_carrito_por_cliente(self):
+		carrito = crear_carrito_cliente(self.user.cliente)
+		with self.assertRaises(IntegrityError), transaction.atomic():
+			Carrito.objects.create(cliente=self.user.cliente)
+
+		# A concurrent request that loses the race gets the existing cart back
+		self.assertEqual(crear_carrito_cliente(self.user.cliente), carrito)
+		self.assertEqual(Carrito.objects.filter(cliente=self.user.cliente).count(), 1)
+
+	def test_carrito_anonimo_persistido_se_fusiona_al_iniciar_sesion(self):
+		otro = Product.objects.create(nombre='Sandalia', precio=Decimal('15.00'), stock=4)
+		expira = timezone.now() + timedelta(minutes=30)
+		destino = Carrito.objects.create(cliente=self.user.cliente)
+		ItemCarrito.objects.create(carrito=destino, producto=self.product, cantidad=2, reserva_expira=expira)
+		origen = Carrito.objects.create()
+		ItemCarrito.objects.create(carrito=origen, producto=self.product, cantidad=3, reserva_expira=expira)
+		ItemCarrito.objects.create(carrito=origen, producto=otro, cantidad=1)
+		Product.objects.filter(pk=self.product.pk).update(stock=5)
+
+		# The anonymous cookie points to the cart persisted at a failed checkout
+		valor = json.dumps({'c': origen.pk})
+		self.client.cookies['carrito'] = signing.get_cookie_signer(salt='carrito' + SALT_CARRITO).sign(valor)
+		self.client.post(reverse('client-login'), {'username': 'cliente1', 'password': 'testpass'})
+
+		self.assertFalse(Carrito.objects.filter(pk=origen.pk).exists())
+		lineas = {item.producto_id: item for item in destino.itemcarrito_set.all()}
+		self.assertEqual(lineas[self.product.id].cantidad, 5)
+		self.assertIsNotNone(lineas[self.product.id].reserva_expira)
+		self.assertEqual(lineas[otro.id].cantidad, 1)
+		destino.refresh_from_db()
+		self.assertEqual((destino.num_lineas, destino.num_unidades), (2, 6))
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 5)
+
+	def test_lineas_del_carrito_se_cargan_en_consultas_fijas(self):
+		carrito = Carrito.objects.create(cliente=self.user.cliente)
+		for n in range(5):
+			bota = Product.objects.create(nombre=f'Bota {n}', precio=Decimal('20.00'), stock=0)
+			ProductSize.objects.create(producto=bota, talla='41', stock=3)
+			ProductImage.objects.create(producto=bota, imagen=f'https://img.test/{n}.jpg', es_principal=True)
+			ItemCarrito.objects.create(carrito=carrito, producto=bota, talla='41', cantidad=1)
+		self.client.login(username='cliente1', password='testpass')
+
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(reverse('carrito_compra'))
+		self.assertContains(response, 'https://img.test/4.jpg')
+		self.assertContains(response, 'max="3"')
+		consultas_lineas = [
+			q['sql'] for q in ctx.captured_queries
+			if any(tabla in q['sql'] for tabla in ('"pedido_itemcarrito"', '"product_productimage"', '"product_productsize"'))
+		]
+		# Page and sidebar share the same CarritoVista: lines (with the denormalized image) and sizes, once each
+		self.assertEqual(len(consultas_lineas), 2)
+		self.assertFalse([sql for sql in consultas_lineas if '"product_productimage"' in sql])
+
+
+class RecomendacionesTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.cliente = User.objects.create_user(username='comprador', password='testpass').cliente
+		self.bota, self.calcetin, self.cordones, self.gorra = [
+			Product.objects.create(nombre=nombre, precio=Decimal('10.00'), stock=10)
+			for nombre in ('Bota', 'Calcetín', 'Cordones', 'Gorra')
+		]
+		self.num = 0
+
+	def _pedido(self, *productos, **kwargs):
+		self.num += 1
+		kwargs.setdefault('estado_pago', 'pagado')
+		pedido = Pedido.objects.create(cliente=self.cliente, numero_pedido=f'REC-{self.num}', **kwargs)
+		for producto in productos:
+			ItemPedido.objects.create(pedido=pedido, producto=producto, precio_unitario=producto.precio)
+		return pedido
+
+	def _vecinos(self, producto):
+		return list(
+			Recomendacion.objects.filter(producto=producto).order_by('posicion').values_list('relacionado__nombre', flat=True)
+		)
+
+	def test_puntua_por_co_compra(self):
+		self._pedido(self.bota, self.calcetin)
+		self._pedido(self.bota, self.calcetin, self.cordones)
+		self._pedido(self.cordones, self.gorra)
+		self._pedido(self.bota, self.gorra, estado=Pedido.EstadoPedido.CANCELADO)
+		# Unpaid orders are not purchases either
+		self._pedido(self.bota, self.gorra, estado_pago='pendiente')
+		call_command('calcular_recomendaciones', stdout=StringIO())
+
+		self.assertEqual(self._vecinos(self.bota), ['Calcetín', 'Cordones'])
+		self.assertEqual(self._vecinos(self.cordones), ['Gorra', 'Bota', 'Calcetín'])
+		self.assertEqual(CoCompra.objects.get(producto=self.bota, relacionado=self.bota).veces, 2)
+
+	def test_incremental_solo_cuenta_pedidos_nuevos(self):
+		self._pedido(self.bota, self.calcetin)
+		actualizar_recomendaciones()
+		self._pedido(self.bota, self.gorra)
+		self._pedido(self.bota, self.gorra)
+
+		with CaptureQueriesContext(connection) as ctx:
+			actualizar_recomendaciones()
+		lecturas = [q['sql'] for q in ctx.captured_queries if 'FROM "pedido_itempedido"' in q['sql']]
+		self.assertEqual(len(lecturas), 1)
+		self.assertEqual(CoCompra.objects.get(producto=self.bota, relacionado=self.calcetin).veces, 1)
+		self.assertEqual(self._vecinos(self.bota), ['Gorra', 'Calcetín'])
+
+		# Nothing new: nothing changes
+		self.assertEqual(actualizar_recomendaciones(), (0, 0, 0))
+		actualizar_recomendaciones(completo=True)
+		self.assertEqual(CoCompra.objects.get(producto=self.bota, relacionado=self.gorra).veces, 2)
+
+	def test_cuenta_pedidos_pagados_tarde_y_resta_los_cancelados(self):
+		primero = self._pedido(self.bota, self.calcetin, estado_pago='pendiente')
+		self._pedido(self.bota, self.gorra)
+		actualizar_recomendaciones()
+		self.assertEqual(self._vecinos(self.bota), ['Gorra'])
+
+		# An older order paid after the last run is still counted
+		primero.estado_pago = 'pagado'
+		primero.save()
+		self.assertEqual(actualizar_recomendaciones()[:2], (1, 0))
+		self.assertEqual(self._vecinos(self.bota), ['Calcetín', 'Gorra'])
+
+		primero.estado = Pedido.EstadoPedido.CANCELADO
+		primero.save()
+		self.assertEqual(actualizar_recomendaciones()[:2], (0, 1))
+		self.assertEqual(self._vecinos(self.bota), ['Gorra'])
+		self.assertFalse(CoCompra.objects.filter(producto=self.calcetin).exists())
+
+	def test_repuntua_los_vecinos_de_los_productos_cambiados(self):
+		self._pedido(self.bota, self.gorra)
+		self._pedido(self.calcetin, self.gorra)
+		actualizar_recomendaciones()
+		self.assertEqual(self._vecinos(self.gorra), ['Bota', 'Calcetín'])
+
+		# Two more socks orders dilute only the socks' score, seen from the cap
+		self._pedido(self.calcetin)
+		self._pedido(self.calcetin)
+		actualizar_recomendaciones()
+		puntuaciones = dict(
+			Recomendacion.objects.filter(producto=self.gorra).values_list('relacionado__nombre', 'puntuacion')
+		)
+		self.assertAlmostEqual(puntuaciones['Calcetín'], 1 / math.sqrt(2 * 3))
+		self.assertEqual(self._vecinos(self.gorra), ['Bota', 'Calcetín'])
 
+	def test_ficha_muestra_primero_los_comprados_juntos(self):
+		self._pedido(self.bota, self.gorra)
+		actualizar_recomendaciones()
+		response = self.client.get(reverse('product:product_detail', args=[self.bota.slug]))
+		self.assertEqual([p.nombre for p in response.context['related_products']][:1], ['Gorra'])
@@ -5,6 +5,7 @@ from django.http import JsonResponse
 from django.conf import settings
 from decimal import Decimal
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import F  
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
@@ -16,89 +17,213 @@ from .models import Pedido, ItemPedido, Carrito, ItemCarrito
 from client.models import Cliente
 from product.models import Product, ProductSize
 from .stripe_api import create_payment_intent
-import uuid, stripe
+from .middleware import get_cliente, get_carrito, get_carrito_anonimo, get_carrito_vista, get_or_create_carrito
+from .carrito_anonimo import CarritoAnonimo
+from .stock import (
+    devolver_stock, devolver_stock_lineas, reservar_stock_lineas, stock_disponible, stock_lineas,
+    nueva_expiracion, ajustar_linea, renovar_reservas, liberar_reservas_si_toca,
+)
+import json, uuid, stripe
 try:
     import resend
 except Exception:
     resend = None
 
 
-def _get_carrito_context(request):
-    """Función auxiliar para obtener el carrito del usuario o sesión"""
-    carrito = None
-    if request.user.is_authenticated:
-        try:
-            cliente = Cliente.objects.get(user=request.user)
-            carrito = Carrito.objects.filter(cliente=cliente).first() 
-        except Cliente.DoesNotExist:
-            pass
-    else:
-        if request.session.session_key:
-            carrito = Carrito.objects.filter(session_key=request.session.session_key).first()
-    return {'carrito': carrito}
+def _is_ajax(request):
+    """Detecta si la petición viene de JavaScript (Sidebar)"""
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
 
 
-def _get_or_create_carrito(request):
-    """Obtiene o crea un carrito de forma robusta (elimina duplicados si existen)"""
-    carrito = None
-    
-    if request.user.is_authenticated:
-        try:
-            cliente = Cliente.objects.get(user=request.user) 
-        except Cliente.DoesNotExist:
-            cliente = Cliente.objects.create(user=request.user, direccion='', ciudad='', codigo_postal='') 
-        
-        qs = Carrito.objects.filter(cliente=cliente)
-        
-        if qs.exists():
-            carrito = qs.first()
-            if qs.count() > 1:
-                for duplicado in qs[1:]:
-                    duplicado.delete()
-        else:
-            carrito = Carrito.objects.create(cliente=cliente, session_key=None)
-        
-        if carrito.session_key:
-            carrito.session_key = None
-            carrito.save()
+def _carrito_fragmento(request):
+    """
+    Líneas, pie y contadores del carrito listos para refrescar el sidebar por AJAX.
+    Salen de CarritoVista, con los precios actuales, igual que las líneas que se pintan.
+    """
+    vista = get_carrito_vista(request)
+    contexto = {'carrito': get_carrito(request), 'carrito_vista': vista}
+    return {
+        'items_html': render_to_string('sidebar_cart_items.html', contexto, request=request),
+        'footer_html': render_to_string('sidebar_cart_footer.html', contexto, request=request),
+        'num_lineas': vista.num_lineas,
+        'num_unidades': vista.num_unidades,
+        'total': str(vista.subtotal.quantize(Decimal('0.01'))),
+    }
 
-    else:
-        if not request.session.session_key:
-            request.session.create()
-        
-        session_key = request.session.session_key
-        
-        qs = Carrito.objects.filter(session_key=session_key)
-        
-        if qs.exists():
-            carrito = qs.first()
-            if qs.count() > 1:
-                for duplicado in qs[1:]:
-                    duplicado.delete()
-        else:
-            carrito = Carrito.objects.create(session_key=session_key, cliente=None)
-    
-    return carrito
+
+def _agregar_linea(carrito, producto, talla, cantidad):
+    """Suma unidades a la línea del producto/talla. Devuelve False si no hay stock suficiente."""
+    if isinstance(carrito, CarritoAnonimo):
+        # El carrito anónimo no reserva: solo se comprueba que haya stock ahora
+        if carrito.cantidad_de(producto.id, talla) + cantidad > stock_disponible(producto.id, talla):
+            return False
+        carrito.agregar(producto, talla, cantidad)
+        return True
+
+    with transaction.atomic():
+        item, created = ItemCarrito.objects.select_for_update().get_or_create(
+            carrito=carrito,
+            producto=producto,
+            talla=talla,
+            defaults={'cantidad': 0}
+        )
+        if not ajustar_linea(item, item.cantidad + cantidad):
+            transaction.set_rollback(True)
+            return False
+        carrito.actualizar_resumen()
+    return True
 
 
-def _get_stock_object(request, item):
-    """Determina si el ítem usa ProductSize o Product stock, y lo devuelve."""
-    producto = item.producto
-    if item.talla:
+def _actualizar_linea(carrito, item_id, nueva_cantidad):
+    """
+    Deja la línea con `nueva_cantidad` unidades (0 la elimina). Lanza ItemCarrito.DoesNotExist
+    si no está en el carrito y devuelve el máximo disponible si no hay stock, o None si se aplicó.
+    """
+    if isinstance(carrito, CarritoAnonimo):
+        _, producto_id, talla, _ = carrito.linea(item_id)
+        if nueva_cantidad > 0:
+            maximo = stock_disponible(producto_id, talla)
+            if nueva_cantidad > maximo:
+                return maximo
+        carrito.actualizar(item_id, nueva_cantidad)
+        return None
+
+    with transaction.atomic():
+        # Bloqueamos la línea para que dos peticiones no la ajusten a la vez
+        item = ItemCarrito.objects.select_for_update().get(id=item_id, carrito=carrito)
+        if nueva_cantidad == 0:
+            devolver_stock(item.producto_id, item.talla, item.cantidad_reservada)
+            item.delete()
+        elif not ajustar_linea(item, nueva_cantidad):
+            return stock_disponible(item.producto_id, item.talla) + item.cantidad_reservada
+        carrito.actualizar_resumen()
+    return None
+
+
+def _eliminar_linea(carrito, item_id):
+    """Quita la línea del carrito devolviendo lo que tenía reservado. Devuelve el nombre del producto."""
+    if isinstance(carrito, CarritoAnonimo):
+        _, producto_id, _, _ = carrito.linea(item_id)
+        carrito.eliminar(item_id)
+        return Product.objects.filter(pk=producto_id).values_list('nombre', flat=True).first() or 'Producto'
+
+    with transaction.atomic():
+        item = ItemCarrito.objects.select_for_update().select_related('producto').get(id=item_id, carrito=carrito)
+        devolver_stock(item.producto_id, item.talla, item.cantidad_reservada)
+        item.delete()
+        carrito.actualizar_resumen()
+    return item.producto.nombre
+
+
+def _cantidades_lote(lineas, operaciones):
+    """
+    Cantidad final de cada SKU `(producto_id, talla)` que tocan las operaciones del lote,
+    aplicadas en orden. `lineas` es {linea_id: (producto_id, talla, cantidad)} del carrito.
+    Lanza ValueError con el mensaje para el usuario si alguna operación no es válida.
+    """
+    actuales = {(producto_id, talla): cantidad for producto_id, talla, cantidad in lineas.values()}
+    productos_ids = {op['producto_id'] for op in operaciones if 'producto_id' in op}
+    existentes = set(Product.objects.filter(pk__in=productos_ids).values_list('pk', flat=True))
+    con_tallas = set(ProductSize.objects.filter(producto_id__in=productos_ids).values_list('producto_id', flat=True))
+    tallas = ProductSize.objects.in_bulk([op['talla_id'] for op in operaciones if op.get('talla_id')])
+
+    objetivo = {}
+    for op in operaciones:
         try:
-            return ProductSize.objects.get(
-                producto=producto, 
-                talla=item.talla
-            )
-        except ProductSize.DoesNotExist:
-            messages.warning(request, f"Advertencia: Talla '{item.talla}' no encontrada. Usando stock de producto general.")
-            return producto
-    return producto
+            cantidad = int(op.get('cantidad', 0))
+        except (TypeError, ValueError):
+            raise ValueError('Cantidad inválida.')
+
+        if 'item_id' in op:
+            if op['item_id'] not in lineas:
+                raise ValueError('Ítem no encontrado.')
+            producto_id, talla, _ = lineas[op['item_id']]
+            objetivo[(producto_id, talla)] = max(cantidad, 0)
+            continue
+
+        producto_id = op.get('producto_id')
+        if producto_id not in existentes:
+            raise ValueError('Producto no encontrado.')
+        talla = None
+        if op.get('talla_id'):
+            talla_obj = tallas.get(op['talla_id'])
+            if talla_obj is None or talla_obj.producto_id != producto_id:
+                raise ValueError('La talla seleccionada no es válida.')
+            talla = talla_obj.talla
+        elif producto_id in con_tallas:
+            raise ValueError('Debes seleccionar una talla.')
+        if cantidad <= 0:
+            raise ValueError('La cantidad debe ser positiva.')
+        sku = (producto_id, talla)
+        objetivo[sku] = objetivo.get(sku, actuales.get(sku, 0)) + cantidad
+    return objetivo
 
 
-def _is_ajax(request):
-    """Detecta si la petición viene de JavaScript (Sidebar)"""
-    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
+def _aplicar_lote(carrito, operaciones):
+    """
+    Aplica todas las operaciones del lote o ninguna. El stock de todas las líneas se
+    ajusta con un UPDATE por tabla. Devuelve None si se aplicó o el mensaje de error.
+    """
+    if isinstance(carrito, CarritoAnonimo):
+        lineas = {linea_id: (producto_id, talla, cantidad) for linea_id, producto_id, talla, cantidad in carrito.filas()}
+        objetivo = _cantidades_lote(lineas, operaciones)
+        actuales = {(producto_id, talla): cantidad for producto_id, talla, cantidad in lineas.values()}
+        suben = [sku for sku, cantidad in objetivo.items() if cantidad > actuales.get(sku, 0)]
+        for sku, maximo in stock_lineas(suben).items():
+            if objetivo[sku] > maximo:
+                return f'Stock insuficiente. Máximo: {maximo}'
+        productos = Product.objects.in_bulk({producto_id for producto_id, _ in suben})
+        for (producto_id, talla), cantidad in objetivo.items():
+            carrito.fijar_cantidad(producto_id, talla, cantidad, productos.get(producto_id))
+        return None
+
+    with transaction.atomic():
+        items = list(carrito.itemcarrito_set.select_for_update())
+        objetivo = _cantidades_lote(
+            {item.id: (item.producto_id, item.talla, item.cantidad) for item in items}, operaciones
+        )
+        por_sku = {(item.producto_id, item.talla): item for item in items}
+
+        reservar, devolver = [], []
+        for (producto_id, talla), cantidad in objetivo.items():
+            item = por_sku.get((producto_id, talla))
+            diferencia = cantidad - (item.cantidad_reservada if item else 0)
+            if diferencia > 0:
+                reservar.append((producto_id, talla, diferencia))
+            else:
+                devolver.append((producto_id, talla, -diferencia))
+        if not reservar_stock_lineas(reservar):
+            transaction.set_rollback(True)
+            return 'No quedan unidades suficientes de alguno de los productos.'
+        devolver_stock_lineas(devolver)
+
+        expira = nueva_expiracion()
+        nuevos, modificados, eliminados = [], [], []
+        for (producto_id, talla), cantidad in objetivo.items():
+            item = por_sku.get((producto_id, talla))
+            if item is None:
+                if cantidad > 0:
+                    nuevos.append(ItemCarrito(
+                        carrito=carrito, producto_id=producto_id, talla=talla,
+                        cantidad=cantidad, reserva_expira=expira,
+                    ))
+            elif cantidad == 0:
+                eliminados.append(item.id)
+            else:
+                item.cantidad = cantidad
+                item.reserva_expira = expira
+                modificados.append(item)
+
+        ItemCarrito.objects.filter(id__in=eliminados).delete()
+        ItemCarrito.objects.bulk_update(modificados, ['cantidad', 'reserva_expira'])
+        ItemCarrito.objects.bulk_create(nuevos)
+        carrito.actualizar_resumen()
+    return None
+
+
+def _carrito_json(request, message):
+    """Respuesta AJAX de éxito que ya incluye el fragmento actualizado del carrito."""
+    return JsonResponse({'success': True, 'message': message, **_carrito_fragmento(request)})
 
 
 # --- Vistas de Carrito ---
@@ -192,15 +317,14 @@ def agregar_al_carrito(request, producto_id):
         talla_obj = None 
         talla_str = None 
         
-        stock_object = producto
+        liberar_reservas_si_toca()
         max_stock = producto.stock
         
-        # 1. Validar stock
+        # 1. Validar stock (comprobación orientativa; la definitiva es el UPDATE condicionado)
         if talla_id:
             try:
                 talla_obj = ProductSize.objects.get(id=talla_id, producto=producto)
                 talla_str = talla_obj.talla 
-                stock_object = talla_obj
                 max_stock = talla_obj.stock
             except ProductSize.DoesNotExist:
                  messages.error(request, 'La talla seleccionada no es válida.')
@@ -218,38 +342,17 @@ def agregar_al_carrito(request, producto_id):
                 messages.error(request, f'Solo quedan {max_stock} unidades disponibles.')
                 return redirect('product:product_detail', slug=producto.slug)
         
-        carrito = _get_or_create_carrito(request)
-        
-        item, created = ItemCarrito.objects.get_or_create(
-            carrito=carrito,
-            producto=producto,
-            talla=talla_str, 
-            defaults={'cantidad': cantidad}
-        )
-        
-        unidades_a_restar = 0
-        stock_valido = True
-        
-        if not created:
-            nueva_cantidad = item.cantidad + cantidad
-            stock_real_disponible = max_stock + item.cantidad 
-            
-            if nueva_cantidad > stock_real_disponible:
-                messages.warning(request, f'No puedes añadir más de {stock_real_disponible} unidades. Ya tienes {item.cantidad}.')
-                stock_valido = False
-            else:
-                unidades_a_restar = cantidad
-                item.cantidad = nueva_cantidad
-                item.save()
-        else:
-            unidades_a_restar = cantidad
+        carrito = get_or_create_carrito(request)
+        stock_valido = _agregar_linea(carrito, producto, talla_str, cantidad)
 
-        if stock_valido and unidades_a_restar > 0:
-            stock_object.stock -= unidades_a_restar
-            stock_object.save()
+        if not stock_valido:
+            msg = f'No quedan unidades suficientes. Disponibles: {stock_disponible(producto.id, talla_str)}.'
+            if _is_ajax(request):
+                return JsonResponse({'success': False, 'message': msg}, status=400)
+            messages.warning(request, msg)
         
         if _is_ajax(request):
-            return JsonResponse({'success': True, 'message': 'Producto añadido.'})
+            return _carrito_json(request, 'Producto añadido.')
             
         if 'redirect_to_cart' in request.POST:
             return redirect('carrito_compra')
@@ -266,18 +369,17 @@ def agregar_al_carrito(request, producto_id):
     return redirect('product:product_list')
 
 
+def _redirect_carrito(request):
+    referer = request.META.get('HTTP_REFERER')
+    if referer and ('cart_open' in referer or 'carrito_compra' in referer):
+        return redirect(referer) 
+            
+    return redirect('carrito_compra')
+
+
 def actualizar_cantidad_carrito(request, item_id):
     """Actualizar cantidad de un item del carrito y ajustar el stock."""
-    carrito = _get_or_create_carrito(request)
-    
-    try:
-        item = ItemCarrito.objects.select_related('producto').get(id=item_id, carrito=carrito) 
-    except ItemCarrito.DoesNotExist:
-        if _is_ajax(request):
-            return JsonResponse({'success': False, 'message': 'Ítem no encontrado.'}, status=404)
-        return redirect('carrito_compra')
-    
-    cantidad_original = item.cantidad 
+    carrito = get_carrito(request)
     
     try:
         nueva_cantidad = int(request.POST.get('cantidad', 1))
@@ -288,70 +390,52 @@ def actualizar_cantidad_carrito(request, item_id):
         
     if nueva_cantidad < 0: nueva_cantidad = 0 
     
-    objeto_stock = _get_stock_object(request, item)
-    stock_disponible_real = objeto_stock.stock + cantidad_original 
-    
+    try:
+        if carrito is None:
+            raise ItemCarrito.DoesNotExist
+        maximo = _actualizar_linea(carrito, item_id, nueva_cantidad)
+    except ItemCarrito.DoesNotExist:
+        if _is_ajax(request):
+            return JsonResponse({'success': False, 'message': 'Ítem no encontrado.'}, status=404)
+        return redirect('carrito_compra')
+    except Exception:
+        if _is_ajax(request): return JsonResponse({'success': False, 'message': 'Error de servidor.'}, status=500)
+        messages.error(request, 'Error al actualizar stock.')
+        return _redirect_carrito(request)
+
+    if maximo is not None:
+        msg = f'Stock insuficiente. Máximo: {maximo}'
+        if _is_ajax(request): return JsonResponse({'success': False, 'message': msg, 'max_qty': maximo}, status=400)
+        messages.error(request, msg)
+        return _redirect_carrito(request)
+
     if nueva_cantidad == 0:
-        try:
-            objeto_stock.stock += cantidad_original
-            objeto_stock.save() 
-            item.delete()
-        except Exception as e:
-            if _is_ajax(request): return JsonResponse({'success': False, 'message': 'Error al eliminar.'}, status=500)
-            messages.error(request, 'Error al eliminar.')
-            return redirect('carrito_compra')
-            
-        if _is_ajax(request): return JsonResponse({'success': True, 'message': 'Ítem eliminado.'})
+        if _is_ajax(request): return _carrito_json(request, 'Ítem eliminado.')
         messages.success(request, 'Item eliminado.')
-    
-    elif nueva_cantidad > stock_disponible_real:
-        msg = f'Stock insuficiente. Máximo: {stock_disponible_real}'
-        if _is_ajax(request): return JsonResponse({'success': False, 'message': msg, 'max_qty': stock_disponible_real}, status=400)
-        messages.error(request, msg)
-        
     else:
-        diferencia = nueva_cantidad - cantidad_original
-        try:
-            objeto_stock.stock -= diferencia
-            objeto_stock.save() 
-            item.cantidad = nueva_cantidad
-            item.save()
-            if _is_ajax(request): return JsonResponse({'success': True, 'message': 'Cantidad actualizada.'})
-            messages.success(request, f'Cantidad actualizada a {nueva_cantidad}.')
-        except Exception:
-            if _is_ajax(request): return JsonResponse({'success': False, 'message': 'Error de servidor.'}, status=500)
-            messages.error(request, 'Error al actualizar stock.')
+        if _is_ajax(request): return _carrito_json(request, 'Cantidad actualizada.')
+        messages.success(request, f'Cantidad actualizada a {nueva_cantidad}.')
 
-    referer = request.META.get('HTTP_REFERER')
-    if referer and ('cart_open' in referer or 'carrito_compra' in referer):
-        return redirect(referer) 
-            
-    return redirect('carrito_compra')
+    return _redirect_carrito(request)
 
 
 def eliminar_del_carrito(request, item_id):
     """Eliminar item del carrito (CORREGIDO para evitar error 500)"""
     
     if request.method == 'POST':
-        carrito = _get_or_create_carrito(request)
+        carrito = get_carrito(request)
         
         try:
-            item = ItemCarrito.objects.select_related('producto').get(id=item_id, carrito=carrito) 
-        except ItemCarrito.DoesNotExist:
-            if _is_ajax(request):
-                return JsonResponse({'success': True, 'message': 'El producto ya no estaba en el carrito.'})
-            messages.warning(request, 'El producto ya no se encuentra en el carrito.')
-            return redirect('carrito_compra')
-            
-        nombre_producto = item.producto.nombre
-        cantidad_a_devolver = item.cantidad
+            try:
+                if carrito is None:
+                    raise ItemCarrito.DoesNotExist
+                nombre_producto = _eliminar_linea(carrito, item_id)
+            except ItemCarrito.DoesNotExist:
+                if _is_ajax(request):
+                    return _carrito_json(request, 'El producto ya no estaba en el carrito.')
+                messages.warning(request, 'El producto ya no se encuentra en el carrito.')
+                return redirect('carrito_compra')
 
-        try:
-            objeto_stock = _get_stock_object(request, item)
-            objeto_stock.stock += cantidad_a_devolver
-            objeto_stock.save()
-            item.delete()
-            
         except Exception as e:
             print(f"Error CRÍTICO eliminando item {item_id}: {e}")
             if _is_ajax(request):
@@ -360,7 +444,7 @@ def eliminar_del_carrito(request, item_id):
             return redirect('carrito_compra')
 
         if _is_ajax(request):
-            return JsonResponse({'success': True, 'message': f'{nombre_producto} eliminado.'})
+            return _carrito_json(request, f'{nombre_producto} eliminado.')
             
         messages.success(request, f'"{nombre_producto}" eliminado del carrito.')
         return redirect('carrito_compra')
@@ -372,15 +456,19 @@ def eliminar_del_carrito(request, item_id):
 def vaciar_carrito(request):
     """Vaciar todo el carrito"""
     if request.method == 'POST':
-        carrito = _get_or_create_carrito(request)
+        carrito = get_carrito(request)
         try:
-            for item in carrito.itemcarrito_set.all():
-                objeto_stock = _get_stock_object(request,item)
-                objeto_stock.stock += item.cantidad
-                objeto_stock.save()
-            carrito.itemcarrito_set.all().delete()
+            if isinstance(carrito, CarritoAnonimo):
+                carrito.vaciar()
+            elif carrito:
+                with transaction.atomic():
+                    # Un UPDATE por tabla para devolver el stock, sea cual sea el tamaño del carrito
+                    reservadas = carrito.itemcarrito_set.select_for_update().filter(reserva_expira__isnull=False)
+                    devolver_stock_lineas(reservadas.values_list('producto_id', 'talla', 'cantidad'))
+                    carrito.itemcarrito_set.all().delete()
+                    carrito.actualizar_resumen()
             
-            if _is_ajax(request): return JsonResponse({'success': True, 'message': 'Carrito vaciado.'})
+            if _is_ajax(request): return _carrito_json(request, 'Carrito vaciado.')
             messages.success(request, 'Tu carrito ha sido vaciado.')
         
         except Exception as e:
@@ -390,23 +478,62 @@ def vaciar_carrito(request):
     return redirect('carrito_compra')
 
 
+def carrito_lote(request):
+    """
+    Aplica varias operaciones sobre el carrito en una sola petición (cuerpo JSON):
+    {"operaciones": [{"item_id": 3, "cantidad": 2}, {"producto_id": 7, "talla_id": 12, "cantidad": 1}]}
+    `item_id` fija la cantidad de una línea (0 la elimina) y `producto_id` añade unidades.
+    Se aplican todas o ninguna y se responde con el carrito resultante.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False}, status=405)
+
+    try:
+        operaciones = json.loads(request.body).get('operaciones')
+        if not isinstance(operaciones, list) or not all(isinstance(op, dict) for op in operaciones):
+            raise ValueError
+        if any(not isinstance(op.get(clave), (int, type(None)))
+               for op in operaciones for clave in ('item_id', 'producto_id', 'talla_id')):
+            raise ValueError
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'message': 'Operaciones no válidas.'}, status=400)
+
+    liberar_reservas_si_toca()
+    if any('producto_id' in op for op in operaciones):
+        carrito = get_or_create_carrito(request)
+    else:
+        carrito = get_carrito(request)
+    if carrito is None or not operaciones:
+        return _carrito_json(request, 'Carrito sin cambios.')
+
+    try:
+        error = _aplicar_lote(carrito, operaciones)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e), **_carrito_fragmento(request)}, status=400)
+    if error:
+        return JsonResponse({'success': False, 'message': error, **_carrito_fragmento(request)}, status=400)
+    return _carrito_json(request, 'Carrito actualizado.')
+
+
+def carrito_fragmento(request):
+    """Devuelve solo el fragmento del carrito (sin renderizar la página completa)."""
+    return JsonResponse(_carrito_fragmento(request))
+
+
 def carrito_compra(request):
     """Vista del carrito de compra"""
-    carrito = _get_or_create_carrito(request)
-    items = ItemCarrito.objects.filter(carrito=carrito).select_related('producto') 
-    
-    subtotal = carrito.get_total()
+    vista = get_carrito_vista(request)
+    subtotal = vista.subtotal
     envio = Decimal('5.00') if Decimal('0') < subtotal < Decimal('50') else Decimal('0')
     total = subtotal + envio
     
     context = {
-        'items': items,
+        'items': vista.lineas,
         'subtotal': subtotal,
         'envio': envio,
         'total': total,
-        'cantidad_items': carrito.get_cantidad_items(),
+        'cantidad_items': vista.num_unidades,
     }
-    context.update(_get_carrito_context(request))
     return render(request, 'carrito_compra.html', context)
 
 def checkout_pedido(request, numero_pedido):
@@ -475,22 +602,20 @@ def listado_pedidos(request):
     if not request.user.is_authenticated:
         messages.info(request, "Como invitado no tienes un historial de pedidos. Revisa tu correo para ver el detalle.")
         return redirect('product:product_list')
-    try:
-        cliente = Cliente.objects.get(user=request.user)
+    cliente = get_cliente(request)
+    if cliente:
         pedidos = Pedido.objects.filter(cliente=cliente).order_by('-fecha_creacion')
-    except Cliente.DoesNotExist:
+    else:
         pedidos = []
         messages.warning(request, 'No tienes un perfil de cliente asociado.')
     context = {'pedidos': pedidos}
-    context.update(_get_carrito_context(request))
     return render(request, 'listado_pedidos.html', context)
 
 
 @login_required
 def detalle_pedido(request, pedido_id):
-    try:
-        cliente = Cliente.objects.get(user=request.user)
-    except Cliente.DoesNotExist:
+    cliente = get_cliente(request)
+    if cliente is None:
         return redirect('listado_pedidos')
     pedido = get_object_or_404(Pedido, id=pedido_id, cliente=cliente)
     
@@ -499,7 +624,6 @@ def detalle_pedido(request, pedido_id):
     )
     
     context = {'pedido': pedido, 'items': items, 'total': pedido.total}
-    context.update(_get_carrito_context(request))
     return render(request, 'detalles_pedido.html', context)
 
 # Modifica esta función para manejar el Cliente que ya fue creado por el signal
@@ -548,7 +672,7 @@ def crear_pedido_desde_carrito(request):
     1. Muestra formulario de datos.
     2. Recibe datos, asigna usuario (real o invitado) y crea el pedido.
     """
-    carrito = _get_or_create_carrito(request)
+    carrito = get_carrito(request)
 
     if not carrito or carrito.get_cantidad_items() == 0:
         messages.error(request, "Tu carrito está vacío.")
@@ -556,8 +680,8 @@ def crear_pedido_desde_carrito(request):
 
     initial_data = {}
     if request.user.is_authenticated:
-        try:
-            cliente = Cliente.objects.get(user=request.user)
+        cliente = get_cliente(request)
+        if cliente:
             initial_data = {
                 'nombre': request.user.first_name or '',
                 'apellidos': request.user.last_name or '',
@@ -567,7 +691,7 @@ def crear_pedido_desde_carrito(request):
                 'telefono': getattr(cliente, 'telefono', ''),
                 'email': request.user.email or '',
             }
-        except Cliente.DoesNotExist:
+        else:
             initial_data = {
                 'nombre': request.user.first_name or '',
                 'apellidos': request.user.last_name or '',
@@ -577,31 +701,42 @@ def crear_pedido_desde_carrito(request):
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
+            # El carrito anónimo solo llega a la BD ahora, al confirmar el pedido
+            if isinstance(carrito, CarritoAnonimo):
+                carrito = carrito.persistir()
+
+            # Todas las líneas deben tener su stock reservado antes de crear el pedido
+            sin_stock = renovar_reservas(carrito)
+            if sin_stock:
+                nombres = ', '.join(item.producto.nombre for item in sin_stock)
+                messages.error(request, f"Ya no queda stock suficiente de: {nombres}. Revisa tu carrito.")
+                return redirect('carrito_compra')
+
             datos = form.cleaned_data
             direccion_completa = f"{datos['direccion']}, {datos['ciudad']}, {datos['codigo_postal']}"
             telefono = datos['telefono']
 
             if request.user.is_authenticated:
-                try:
-                    cliente_pedido = Cliente.objects.get(user=request.user)
-                    # Actualizamos los datos del cliente si el usuario los cambió
-                    cliente_pedido.direccion = datos['direccion']
-                    cliente_pedido.ciudad = datos['ciudad']
-                    cliente_pedido.codigo_postal = datos['codigo_postal']
-                    cliente_pedido.telefono = datos['telefono']
-                    cliente_pedido.save()
-                    
-                    # Actualizamos también el User si cambió nombre/apellidos/email
-                    if datos.get('nombre'):
-                        request.user.first_name = datos['nombre']
-                    if datos.get('apellidos'):
-                        request.user.last_name = datos['apellidos']
-                    if datos.get('email'):
-                        request.user.email = datos['email']
-                    request.user.save()
-                except Cliente.DoesNotExist:
+                cliente_pedido = get_cliente(request)
+                if cliente_pedido is None:
                     messages.error(request, "Error con tu usuario.")
                     return redirect('carrito_compra')
+
+                # Actualizamos los datos del cliente si el usuario los cambió
+                cliente_pedido.direccion = datos['direccion']
+                cliente_pedido.ciudad = datos['ciudad']
+                cliente_pedido.codigo_postal = datos['codigo_postal']
+                cliente_pedido.telefono = datos['telefono']
+                cliente_pedido.save()
+                
+                # Actualizamos también el User si cambió nombre/apellidos/email
+                if datos.get('nombre'):
+                    request.user.first_name = datos['nombre']
+                if datos.get('apellidos'):
+                    request.user.last_name = datos['apellidos']
+                if datos.get('email'):
+                    request.user.email = datos['email']
+                request.user.save()
             else:
                 # Pasamos los datos del formulario a la función
                 cliente_pedido = _get_cliente_invitado(datos)
@@ -610,27 +745,38 @@ def crear_pedido_desde_carrito(request):
             subtotal = carrito.get_total()
             envio = Decimal("5.00") if subtotal > 0 and subtotal < 50 else Decimal("0.00")
             
-            pedido = Pedido.objects.create(
-                cliente=cliente_pedido,
-                numero_pedido=numero_pedido,
-                subtotal=subtotal,
-                impuestos=Decimal("0.00"),
-                coste_entrega=envio,
-                descuento=Decimal("0.00"),
-                direccion_envio=direccion_completa,
-                telefono=telefono,
-            )
-
-            for item in carrito.itemcarrito_set.select_related('producto'):
-                ItemPedido.objects.create(
-                    pedido=pedido,
-                    producto=item.producto,
-                    talla=item.talla,
-                    cantidad=item.cantidad,
-                    precio_unitario=item.producto.precio_final,
+            # El pedido, sus líneas y el vaciado del carrito se confirman juntos: nadie ve
+            # (ni cuenta en pedido/recomendaciones.py) un pedido a medias
+            with transaction.atomic():
+                pedido = Pedido.objects.create(
+                    cliente=cliente_pedido,
+                    numero_pedido=numero_pedido,
+                    subtotal=subtotal,
+                    impuestos=Decimal("0.00"),
+                    coste_entrega=envio,
+                    descuento=Decimal("0.00"),
+                    direccion_envio=direccion_completa,
+                    telefono=telefono,
                 )
 
-            carrito.itemcarrito_set.all().delete()
+                for item in carrito.itemcarrito_set.select_related('producto'):
+                    ItemPedido.objects.create(
+                        pedido=pedido,
+                        producto=item.producto,
+                        talla=item.talla,
+                        cantidad=item.cantidad,
+                        precio_unitario=item.producto.precio_final,
+                    )
+
+                carrito.itemcarrito_set.all().delete()
+                if carrito.cliente_id is None:
+                    # El carrito anónimo ya ha cumplido su función: la cookie vuelve a estar vacía
+                    carrito.delete()
+                    anonimo = get_carrito_anonimo(request)
+                    anonimo.carrito_id = None
+                    anonimo.modificado = True
+                else:
+                    carrito.actualizar_resumen()
 
             return redirect('checkout_pedido', numero_pedido=pedido.numero_pedido)
     else:
@@ -662,7 +808,6 @@ def rastrear_pedido(request):
                     'items': items, 
                     'total': pedido.total
                 }
-                context.update(_get_carrito_context(request))
                 return render(request, 'detalles_pedido.html', context)
             else:
                 messages.error(request, "No encontramos un pedido con ese número y teléfono.")
@@ -670,5 +815,4 @@ def rastrear_pedido(request):
         form = OrderTrackingForm()
 
     context = {'form': form}
-    context.update(_get_carrito_context(request))
     return render(request, 'rastrear_pedido.html', context)
\ No newline at end of file
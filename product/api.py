@@ -0,0 +1,189 @@
+"""
+API JSON de solo lectura del catálogo (v1): productos, tallas, imágenes, categorías y marcas.
+
+- `?campos=nombre,precio_final` elige las columnas (sparse fieldsets).
+- `?expandir=marca,categoria,tallas,imagenes` incluye las relaciones: marca y categoría
+  salen en la misma consulta con un JOIN, tallas e imágenes con una consulta más cada una.
+- Los productos se paginan por cursor (`?cursor=`, `?limite=`) como el catálogo.
+
+Todo se lee con values(), sin instanciar modelos, así que cada respuesta son como mucho
+tres consultas. Las respuestas llevan ETag y un max-age público de API_CACHE_SEGUNDOS.
+"""
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+
+from .models import Product, ProductSize, ProductImage, Category, Brand
+from .paginacion import paginar_por_cursor
+from .tallas import filtrar_por_talla
+from .validadores import etag_api
+from .views import ORDENES
+
+CAMPOS_PRODUCTO = (
+    'id', 'slug', 'nombre', 'descripcion', 'precio', 'oferta', 'precio_final', 'genero', 'color',
+    'material', 'stock', 'destacado', 'imagen_url', 'creado', 'modificado', 'categoria', 'marca',
+)
+CAMPOS_PRODUCTO_DEFECTO = ('id', 'slug', 'nombre', 'precio_final', 'imagen_url')
+CAMPOS_CATEGORIA = ('id', 'slug', 'nombre', 'descripcion', 'imagen')
+CAMPOS_MARCA = ('id', 'slug', 'nombre', 'imagen')
+
+# Relaciones a uno: como campo dan el slug y expandidas, el objeto (mismo JOIN)
+RELACIONES = {'categoria': ('id', 'slug', 'nombre'), 'marca': ('id', 'slug', 'nombre')}
+# Relaciones a muchos: una consulta por relación para toda la página
+HIJOS = {
+    'tallas': (ProductSize, ('id', 'talla', 'stock'), ('producto_id', 'id')),
+    'imagenes': (ProductImage, ('id', 'imagen', 'es_principal', 'orden'), ('producto_id', '-es_principal', 'orden', 'id')),
+}
+# Columnas con la URL o la ruta de una imagen: salen siempre como URL absoluta
+CAMPOS_IMAGEN = {'imagen', 'imagen_url'}
+LIMITE_DEFECTO = 24
+LIMITE_MAXIMO = 100
+
+cache_api = cache_control(public=True, max_age=settings.API_CACHE_SEGUNDOS)
+
+
+def _error(mensaje, status=400):
+    return JsonResponse({'success': False, 'message': mensaje}, status=status)
+
+
+def _lista(request, parametro, permitidos, por_defecto=()):
+    """Valores separados por comas de `parametro`; ValueError si alguno no está permitido."""
+    valor = request.GET.get(parametro)
+    if not valor:
+        return list(por_defecto)
+    elegidos = list(dict.fromkeys(v.strip() for v in valor.split(',') if v.strip()))
+    desconocidos = [v for v in elegidos if v not in permitidos]
+    if desconocidos:
+        raise ValueError(f'Valores no válidos en {parametro}: {", ".join(desconocidos)}')
+    return elegidos
+
+
+def _url_imagen(request, valor):
+    """URL absoluta de una imagen guardada como URL completa o como ruta (relativa a MEDIA_URL)."""
+    if not valor or urlsplit(valor).scheme:
+        return valor
+    return request.build_absolute_uri(urljoin(settings.MEDIA_URL or '/', valor))
+
+
+def _con_urls(request, objeto):
+    for campo in CAMPOS_IMAGEN & objeto.keys():
+        objeto[campo] = _url_imagen(request, objeto[campo])
+    return objeto
+
+
+def _proyectar(queryset, campos, expandir):
+    """values() con las columnas pedidas, más las de ORDENES que necesita el cursor y el id de los hijos."""
+    columnas = {'id', 'creado', 'precio_final'}
+    for campo in campos:
+        columnas.add(f'{campo}__slug' if campo in RELACIONES else campo)
+    for relacion in expandir:
+        if relacion in RELACIONES:
+            columnas.update(f'{relacion}__{columna}' for columna in RELACIONES[relacion])
+    return queryset.values(*columnas)
+
+
+def _serializar(request, filas, campos, expandir):
+    resultado = []
+    for fila in filas:
+        objeto = _con_urls(request, {
+            campo: fila[f'{campo}__slug'] if campo in RELACIONES else fila[campo] for campo in campos
+        })
+        for relacion in expandir:
+            if relacion in RELACIONES:
+                objeto[relacion] = None if fila[f'{relacion}__id'] is None else {
+                    columna: fila[f'{relacion}__{columna}'] for columna in RELACIONES[relacion]
+                }
+        resultado.append(objeto)
+
+    ids = [fila['id'] for fila in filas]
+    for relacion in expandir:
+        if relacion not in HIJOS or not ids:
+            continue
+        modelo, columnas, orden = HIJOS[relacion]
+        por_producto = defaultdict(list)
+        for hijo in modelo.objects.filter(producto_id__in=ids).order_by(*orden).values('producto_id', *columnas):
+            por_producto[hijo.pop('producto_id')].append(_con_urls(request, hijo))
+        for objeto, producto_id in zip(resultado, ids):
+            objeto[relacion] = por_producto[producto_id]
+    return resultado
+
+
+def _campos_producto(request):
+    campos = _lista(request, 'campos', CAMPOS_PRODUCTO, CAMPOS_PRODUCTO_DEFECTO)
+    expandir = _lista(request, 'expandir', tuple(RELACIONES) + tuple(HIJOS))
+    return campos, expandir
+
+
+@require_GET
+@cache_api
+@condition(etag_func=etag_api)
+def productos(request):
+    """Productos disponibles, filtrables por categoria, marca, genero y talla, y ordenables."""
+    try:
+        campos, expandir = _campos_producto(request)
+        limite = min(int(request.GET.get('limite', LIMITE_DEFECTO)), LIMITE_MAXIMO)
+    except ValueError as e:
+        return _error(str(e))
+    if limite < 1:
+        return _error('limite debe ser mayor que cero.')
+
+    queryset = Product.objects.filter(disponible=True)
+    if request.GET.get('categoria'):
+        queryset = queryset.filter(categoria__slug=request.GET['categoria'])
+    if request.GET.get('marca'):
+        queryset = queryset.filter(marca__slug=request.GET['marca'])
+    if request.GET.get('genero'):
+        queryset = queryset.filter(genero=request.GET['genero'])
+    if request.GET.get('talla'):
+        queryset = filtrar_por_talla(queryset, request.GET['talla'])
+    if request.GET.get('orden') in ORDENES:
+        queryset = queryset.order_by(*ORDENES[request.GET['orden']])
+
+    pagina = paginar_por_cursor(_proyectar(queryset, campos, expandir), request.GET.get('cursor'), limite)
+    siguiente = None
+    if pagina.has_next():
+        params = request.GET.copy()
+        params['cursor'] = pagina.siguiente
+        siguiente = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    return JsonResponse({'resultados': _serializar(request, pagina.object_list, campos, expandir), 'siguiente': siguiente})
+
+
+@require_GET
+@cache_api
+@condition(etag_func=etag_api)
+def producto(request, slug):
+    try:
+        campos, expandir = _campos_producto(request)
+    except ValueError as e:
+        return _error(str(e))
+    filas = list(_proyectar(Product.objects.filter(slug=slug, disponible=True), campos, expandir)[:1])
+    if not filas:
+        return _error('Producto no encontrado.', status=404)
+    return JsonResponse(_serializar(request, filas, campos, expandir)[0])
+
+
+def _listado_simple(request, modelo, permitidos):
+    try:
+        campos = _lista(request, 'campos', permitidos, permitidos)
+    except ValueError as e:
+        return _error(str(e))
+    filas = modelo.objects.order_by('nombre').values(*campos)
+    return JsonResponse({'resultados': [_con_urls(request, fila) for fila in filas]})
+
+
+@require_GET
+@cache_api
+@condition(etag_func=etag_api)
+def categorias(request):
+    return _listado_simple(request, Category, CAMPOS_CATEGORIA)
+
+
+@require_GET
+@cache_api
+@condition(etag_func=etag_api)
+def marcas(request):
+    return _listado_simple(request, Brand, CAMPOS_MARCA)
@@ -0,0 +1,11 @@
+from django.urls import path
+from . import api
+
+app_name = 'api_v1'
+
+urlpatterns = [
+    path('productos/', api.productos, name='productos'),
+    path('productos/<slug:slug>/', api.producto, name='producto'),
+    path('categorias/', api.categorias, name='categorias'),
+    path('marcas/', api.marcas, name='marcas'),
+]
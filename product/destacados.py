@@ -0,0 +1,58 @@
+"""
+Rotación de productos destacados para la portada sin `order_by('?')` en cada visita.
+
+La caché guarda una lista barajada de ids elegibles: primero los marcados como
+`destacado` y, si no llegan para una portada, otros disponibles hasta POOL_MAXIMO.
+Cada visita elige un tramo a partir de una posición al azar y carga esas filas por
+clave primaria. La lista se rehace al caducar (DESTACADOS_REFRESCO_SEGUNDOS), al guardar
+o borrar un producto, o con el comando `rotar_destacados`.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product
+
+CLAVE_POOL = 'product:destacados'
+POOL_MAXIMO = 200
+
+
+def construir_pool(minimo=3):
+    """Baraja los ids elegibles, los guarda en la caché y los devuelve."""
+    disponibles = Product.objects.filter(disponible=True)
+    ids = list(disponibles.filter(destacado=True).values_list('pk', flat=True)[:POOL_MAXIMO])
+    random.shuffle(ids)
+    if len(ids) < minimo:
+        # El sorteo entre el resto solo se paga al reconstruir, no en cada visita, y en Python:
+        # traer solo los ids es más barato que ORDER BY RANDOM() sobre las filas completas
+        otros = list(disponibles.filter(destacado=False).values_list('pk', flat=True))
+        ids += random.sample(otros, min(len(otros), POOL_MAXIMO - len(ids)))
+    cache.set(CLAVE_POOL, ids, settings.DESTACADOS_REFRESCO_SEGUNDOS)
+    return ids
+
+
+def destacados(cantidad=3):
+    """`cantidad` productos del pool, consecutivos desde una posición al azar."""
+    pool = cache.get(CLAVE_POOL)
+    if pool is None:
+        pool = construir_pool(cantidad)
+    if not pool:
+        return []
+
+    inicio = random.randrange(len(pool))
+    ids = [pool[(inicio + i) % len(pool)] for i in range(min(cantidad, len(pool)))]
+    productos = Product.objects.filter(disponible=True).select_related('marca').in_bulk(ids)
+    return [productos[pk] for pk in ids if pk in productos]
+
+
+def invalidar():
+    cache.delete(CLAVE_POOL)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def _producto_modificado(sender, raw=False, **kwargs):
+    if not raw:
+        invalidar()
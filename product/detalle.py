@@ -0,0 +1,158 @@
+"""
+Caché de la ficha de producto: el producto con sus imágenes, tallas, categoría y marca,
+más los relacionados (comprados juntos o de la misma categoría) y sus tarjetas ya
+renderizadas, por slug.
+
+Lo que depende del usuario (carrito, CSRF, mensajes) se sigue pintando en cada petición,
+y el stock se relee siempre porque las compras lo descuentan con UPDATE, sin señales.
+
+Cada producto tiene su versión: la hora de su último cambio (en él, sus tallas o
+imágenes, su categoría o su marca). Una entrada vale mientras ninguno de los productos
+que pinta (el suyo y los relacionados) haya cambiado después de calcularla, lo que se
+comprueba con una sola lectura de la caché. Así un cambio solo descarta las fichas que
+lo muestran, no todas; un slug renombrado deja de servirse porque su producto cambió.
+
+Contra la estampida, cada entrada tiene una caducidad lógica anterior a la real. Al
+pasarla, un solo proceso (el que consigue el cerrojo con cache.add) la recalcula
+mientras los demás siguen sirviendo la copia anterior; si no hay copia, esperan un
+momento a que la deje el que calcula en lugar de ir todos a la base de datos.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.shortcuts import get_object_or_404
+
+from pedido.models import Recomendacion
+
+from .models import Product, ProductSize, ProductImage, Category, Brand
+from .tarjetas import tarjetas
+
+CLAVE_VERSION = 'product:detalle_version'
+# Tiempo que se conserva la copia pasada su caducidad lógica y máximo de un recálculo
+MARGEN_SEGUNDOS = 60
+ESPERA_SEGUNDOS = 0.05
+ESPERAS = 20
+
+
+def _calcular(slug):
+    product = get_object_or_404(
+        Product.objects.prefetch_related('imagenes', 'tallas').select_related('categoria', 'marca'),
+        slug=slug,
+        disponible=True
+    )
+    # Primero los comprados junto a este (pedido/recomendaciones.py), luego los de su categoría
+    related_products = [
+        recomendacion.relacionado
+        for recomendacion in Recomendacion.objects.filter(producto=product, relacionado__disponible=True)
+        .select_related('relacionado__marca').order_by('posicion')[:4]
+    ]
+    if len(related_products) < 4:
+        related_products += Product.objects.filter(
+            categoria=product.categoria,
+            disponible=True
+        ).exclude(id__in=[product.id] + [p.id for p in related_products]).select_related('marca')[:4 - len(related_products)]
+    return {
+        'product': product,
+        'related_products': related_products,
+        'tarjetas_relacionados': tarjetas(related_products, 'product_card_relacionado.html'),
+    }
+
+
+def _clave_version(pk):
+    return f'{CLAVE_VERSION}:{pk}'
+
+
+def _productos_de(datos):
+    return [datos['product'].pk] + [p.pk for p in datos['related_products']]
+
+
+def _vigente(entrada):
+    """Ningún producto de la entrada ha cambiado desde que se calculó (versión perdida = cambiado)."""
+    _, ids, calculado, _ = entrada
+    versiones = cache.get_many([_clave_version(pk) for pk in ids])
+    return len(versiones) == len(ids) and all(version < calculado for version in versiones.values())
+
+
+def _obtener(clave, calcular):
+    """
+    (valor, hora de cálculo) de `clave`, recalculado por un único proceso cuando caduca
+    o se invalida.
+    """
+    entrada = cache.get(clave)
+    if entrada is not None and not _vigente(entrada):
+        entrada = None
+    if entrada is not None:
+        datos, _, calculado, renovar_en = entrada
+        if time.time() < renovar_en or not cache.add(f'{clave}:bloqueo', 1, MARGEN_SEGUNDOS):
+            return datos, calculado
+        bloqueo = True
+    else:
+        bloqueo = cache.add(f'{clave}:bloqueo', 1, MARGEN_SEGUNDOS)
+        if not bloqueo:
+            for _ in range(ESPERAS):
+                time.sleep(ESPERA_SEGUNDOS)
+                entrada = cache.get(clave)
+                if entrada is not None and _vigente(entrada):
+                    return entrada[0], entrada[2]
+
+    try:
+        # La hora se toma antes de leer la BD: un cambio durante el cálculo invalida la entrada
+        calculado = time.time()
+        datos = calcular()
+        ids = _productos_de(datos)
+        for pk in ids:
+            # Sin cambios registrados la versión es 0; si se pierde, la entrada deja de valer
+            cache.add(_clave_version(pk), 0, timeout=None)
+        segundos = settings.DETALLE_CACHE_SEGUNDOS
+        cache.set(clave, (datos, ids, calculado, calculado + segundos), segundos + MARGEN_SEGUNDOS)
+    finally:
+        if bloqueo:
+            cache.delete(f'{clave}:bloqueo')
+    return datos, calculado
+
+
+def datos_detalle(slug):
+    """Contexto de la ficha de `slug` (404 si no existe o no está disponible) con el stock al día."""
+    datos, _ = _obtener(f'product:detalle:{slug}', lambda: _calcular(slug))
+
+    product = datos['product']
+    product.stock = Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+    stock_tallas = dict(ProductSize.objects.filter(producto_id=product.pk).values_list('id', 'stock'))
+    for talla in product.tallas.all():
+        talla.stock = stock_tallas.get(talla.id, 0)
+    return datos
+
+
+def version_ficha(slug):
+    """Hora de cálculo de la entrada vigente de `slug` (la calcula si hace falta), para los ETag."""
+    return _obtener(f'product:detalle:{slug}', lambda: _calcular(slug))[1]
+
+
+def invalidar(ids):
+    """Marca como cambiados los productos `ids`: las fichas que los pintan se recalculan."""
+    ahora = time.time()
+    cache.set_many({_clave_version(pk): ahora for pk in ids}, timeout=None)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def _producto_modificado(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidar([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductSize)
+@receiver([post_save, post_delete], sender=ProductImage)
+def _hijo_modificado(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidar([instance.producto_id])
+
+
+# Al borrar una categoría o marca sus productos quedan con NULL sin señales: se recogen antes
+@receiver([post_save, pre_delete], sender=Category)
+@receiver([post_save, pre_delete], sender=Brand)
+def _agrupacion_modificada(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidar(instance.productos.values_list('pk', flat=True))
@@ -0,0 +1,52 @@
+from django.db.models import Count
+
+from .models import Product
+
+FACETAS = ('categoria', 'marca', 'genero', 'color', 'material')
+
+
+def calcular_facetas(productos, seleccion):
+    """
+    Recuento de productos por opción de cada faceta para el estado actual de los filtros,
+    con una sola consulta agrupada. Cada faceta se cuenta aplicando los filtros de las
+    demás pero no el suyo, para mostrar cuántos productos habría al elegir otra opción.
+
+    `productos` es el queryset antes de aplicar las facetas (disponibles y búsqueda) y
+    `seleccion` el valor elegido de cada faceta ('' o None si no hay filtro).
+    Devuelve {faceta: [{'valor', 'nombre', 'total'}, ...]} sin las opciones vacías.
+    """
+    filas = (
+        Product.objects.filter(pk__in=productos.values('pk'))
+        .values('categoria__slug', 'categoria__nombre', 'marca__slug', 'marca__nombre', 'genero', 'color', 'material')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    generos = dict(Product.GENDER_CHOICES)
+
+    recuentos = {faceta: {} for faceta in FACETAS}
+    for fila in filas:
+        valores = {
+            'categoria': (fila['categoria__slug'], fila['categoria__nombre']),
+            'marca': (fila['marca__slug'], fila['marca__nombre']),
+            'genero': (fila['genero'], generos.get(fila['genero'], fila['genero'])),
+            'color': (fila['color'], fila['color']),
+            'material': (fila['material'], fila['material']),
+        }
+        for faceta in FACETAS:
+            valor, nombre = valores[faceta]
+            if not valor:
+                continue
+            if all(not seleccion.get(otra) or valores[otra][0] == seleccion[otra] for otra in FACETAS if otra != faceta):
+                opcion = recuentos[faceta].setdefault(valor, {'valor': valor, 'nombre': nombre, 'total': 0})
+                opcion['total'] += fila['total']
+
+    # La opción elegida se sigue mostrando aunque se haya quedado sin productos
+    for faceta in FACETAS:
+        elegido = seleccion.get(faceta)
+        if elegido and elegido not in recuentos[faceta]:
+            recuentos[faceta][elegido] = {'valor': elegido, 'nombre': generos.get(elegido, elegido) if faceta == 'genero' else elegido, 'total': 0}
+
+    return {
+        faceta: sorted(opciones.values(), key=lambda opcion: str(opcion['nombre']).lower())
+        for faceta, opciones in recuentos.items()
+    }
@@ -0,0 +1,40 @@
+"""
+Copia de la URL de la imagen principal en `Product.imagen_url`, para que listados,
+tarjetas y carrito la pinten sin consultar `ProductImage`.
+
+La principal es la marcada con `es_principal` o, si no hay ninguna, la primera por
+`orden`, igual que `Product.imagen_principal()`. Se recalcula con un único UPDATE al
+guardar o borrar una imagen; `rellenar_imagenes` la reconstruye para todo el catálogo.
+"""
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, ProductImage
+
+
+def imagen_principal_subquery():
+    """URL de la imagen principal de cada producto (o '') como subconsulta correlacionada."""
+    return Coalesce(
+        Subquery(
+            ProductImage.objects.filter(producto=OuterRef('pk'))
+            .order_by('-es_principal', 'orden', 'id')
+            .values('imagen')[:1]
+        ),
+        Value(''),
+    )
+
+
+def actualizar_imagen_url(ids=None):
+    """Recalcula `imagen_url` de los productos `ids` (o de todos) y devuelve cuántos ha tocado."""
+    productos = Product.objects.all() if ids is None else Product.objects.filter(pk__in=ids)
+    # `modificado` cambia también para que caduquen sus tarjetas en caché (product/tarjetas.py)
+    return productos.update(imagen_url=imagen_principal_subquery(), modificado=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def _imagen_modificada(sender, instance, raw=False, **kwargs):
+    if not raw:
+        actualizar_imagen_url([instance.producto_id])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.imagenes import actualizar_imagen_url
+
+
+class Command(BaseCommand):
+    help = 'Fill the denormalized main image URL of every product from its images'
+
+    def handle(self, *args, **options):
+        total = actualizar_imagen_url()
+        self.stdout.write(self.style.SUCCESS(f'Main image URL updated for {total} products.'))
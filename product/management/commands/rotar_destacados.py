@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from product.destacados import construir_pool
+
+
+class Command(BaseCommand):
+    help = 'Reshuffle the pool of featured products shown on the home page'
+
+    def handle(self, *args, **options):
+        pool = construir_pool()
+        self.stdout.write(self.style.SUCCESS(f'Featured pool rebuilt with {len(pool)} products.'))
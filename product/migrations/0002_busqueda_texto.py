@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:30
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def crear_indice_busqueda(apps, schema_editor):
+    """GIN sobre search_vector en PostgreSQL y tabla FTS5 en SQLite, ya rellenos."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE product_product p SET search_vector = "
+            "setweight(to_tsvector('spanish', coalesce(p.nombre, '')), 'A') || "
+            "setweight(to_tsvector('spanish', coalesce((SELECT b.nombre FROM product_brand b WHERE b.id = p.marca_id), '')), 'A') || "
+            "setweight(to_tsvector('spanish', coalesce(p.color, '') || ' ' || coalesce(p.material, '')), 'B') || "
+            "setweight(to_tsvector('spanish', coalesce(p.descripcion, '')), 'C')"
+        )
+        schema_editor.execute(
+            'CREATE INDEX product_busqueda_gin ON product_product USING gin (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE product_busqueda USING fts5('
+            'nombre, marca, color, material, descripcion, '
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            'INSERT INTO product_busqueda (rowid, nombre, marca, color, material, descripcion) '
+            "SELECT p.id, p.nombre, coalesce(b.nombre, ''), p.color, p.material, p.descripcion "
+            'FROM product_product p LEFT JOIN product_brand b ON b.id = p.marca_id'
+        )
+
+
+def borrar_indice_busqueda(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS product_busqueda_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS product_busqueda')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(crear_indice_busqueda, borrar_indice_busqueda),
+    ]
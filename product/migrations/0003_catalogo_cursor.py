@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0002_busqueda_texto'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='product',
+            options={'ordering': ('-creado', '-id'), 'verbose_name': 'Producto', 'verbose_name_plural': 'Productos'},
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['disponible', '-creado', '-id'], name='product_catalogo_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:39
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def rellenar_imagen_url(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    ProductImage = apps.get_model('product', 'ProductImage')
+    Product.objects.update(imagen_url=Coalesce(
+        Subquery(
+            ProductImage.objects.filter(producto=OuterRef('pk'))
+            .order_by('-es_principal', 'orden', 'id')
+            .values('imagen')[:1]
+        ),
+        Value(''),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_catalogo_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='imagen_url',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.RunPython(rellenar_imagen_url, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:46
+
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def rellenar_tallas_disponibles(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    ProductSize = apps.get_model('product', 'ProductSize')
+    bits = Case(
+        *[When(talla=str(talla), then=Value(1 << i)) for i, talla in enumerate(range(36, 46))],
+        default=Value(0), output_field=models.IntegerField(),
+    )
+    Product.objects.update(tallas_disponibles=Coalesce(
+        Subquery(
+            ProductSize.objects.filter(producto=OuterRef('pk'), stock__gt=0)
+            .order_by().values('producto').annotate(mascara=Sum(bits)).values('mascara')[:1]
+        ),
+        Value(0),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_imagen_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='tallas_disponibles',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(rellenar_tallas_disponibles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:48
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def rellenar_precio_final(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Product.objects.update(precio_final=Round(ExpressionWrapper(
+        F('precio') - F('precio') * Coalesce(F('oferta'), Value(Decimal('0'))) / Value(Decimal('100')),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    ), 2))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_tallas_disponibles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='precio_final',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10),
+        ),
+        migrations.RunPython(rellenar_precio_final, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['disponible', 'precio_final', 'id'], name='product_precio_idx'),
+        ),
+    ]
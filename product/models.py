@@ -1,8 +1,14 @@
 # Create your models here.
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, Value
+from django.db.models.functions import Coalesce, Round
 from django.utils import timezone
 from django.utils.text import slugify
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
+
+# Tallas de la máscara Product.tallas_disponibles: el bit i es la talla TALLAS_ESTANDAR[i]
+TALLAS_ESTANDAR = tuple(str(talla) for talla in range(36, 46))
 
 
 class Category(models.Model):
@@ -42,6 +48,61 @@ class Brand(models.Model):
         return self.nombre
 
 
+def precio_final_expr(precio=None, oferta=None):
+    """Precio con el descuento de `oferta` aplicado, como expresión SQL (por defecto sobre las columnas)."""
+    precio = F('precio') if precio is None else precio
+    oferta = F('oferta') if oferta is None else oferta
+    return Round(ExpressionWrapper(
+        precio - precio * Coalesce(oferta, Value(Decimal('0'))) / Value(Decimal('100')),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    ), 2)
+
+
+def _precio_cambiado(ids):
+    """Las fichas cacheadas de `ids` muestran el precio (las tarjetas caducan con `modificado`)."""
+    from .detalle import invalidar
+    invalidar(ids)
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Mantiene `precio_final` al día también en las actualizaciones masivas, que no envían
+    señales: al cambiar el precio toca también `modificado` e invalida las fichas.
+    """
+
+    def update(self, **kwargs):
+        if 'precio' not in kwargs and 'oferta' not in kwargs:
+            return super().update(**kwargs)
+        if 'precio_final' not in kwargs:
+            # En un UPDATE las expresiones ven los valores anteriores: se calcula con los nuevos
+            nuevos = {
+                campo: valor if hasattr(valor, 'resolve_expression') else Value(
+                    None if valor is None else Decimal(str(valor)),
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                )
+                for campo, valor in kwargs.items() if campo in ('precio', 'oferta')
+            }
+            kwargs['precio_final'] = precio_final_expr(nuevos.get('precio'), nuevos.get('oferta'))
+        kwargs.setdefault('modificado', timezone.now())
+        ids = list(self.values_list('pk', flat=True))
+        filas = super().update(**kwargs)
+        _precio_cambiado(ids)
+        return filas
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        fields = list(fields)
+        if 'precio' not in fields and 'oferta' not in fields:
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+        ahora = timezone.now()
+        for obj in objs:
+            obj.precio_final = obj.calcular_precio_final()
+            obj.modificado = ahora
+        fields += [campo for campo in ('precio_final', 'modificado') if campo not in fields]
+        filas = super().bulk_update(objs, fields, batch_size=batch_size)
+        _precio_cambiado([obj.pk for obj in objs])
+        return filas
+
+
 class Product(models.Model):
     GENDER_CHOICES = (
         ('U', 'Unisex'),
@@ -56,6 +117,8 @@ class Product(models.Model):
     precio = models.DecimalField(max_digits=10, decimal_places=2)
     oferta = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True,
                                  help_text='Descuento en porcentaje (ej: 10 = 10%)')
+    # Precio de venta (precio con la oferta aplicada), guardado para ordenar y filtrar en BD
+    precio_final = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False)
     genero = models.CharField(max_length=1, choices=GENDER_CHOICES, default='U')
     color = models.CharField(max_length=80, blank=True)
     material = models.CharField(max_length=120, blank=True)
@@ -68,22 +131,48 @@ class Product(models.Model):
     categoria = models.ForeignKey(Category, related_name='productos', on_delete=models.SET_NULL, null=True, blank=True)
     marca = models.ForeignKey(Brand, related_name='productos', on_delete=models.SET_NULL, null=True, blank=True)
 
+    # Bit i a 1 si la talla TALLAS_ESTANDAR[i] tiene stock, mantenido por product/tallas.py
+    tallas_disponibles = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    # Copia de la URL de la imagen principal, mantenida por product/imagenes.py
+    imagen_url = models.CharField(max_length=500, blank=True, editable=False)
+
+    # Índice de búsqueda en PostgreSQL (ver product/search.py); en SQLite queda vacío
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
-        ordering = ('-creado',)
+        ordering = ('-creado', '-id')
+        # El catálogo se pagina por cursor sobre (creado, id), ver product/paginacion.py
+        indexes = [
+            models.Index(fields=['disponible', '-creado', '-id'], name='product_catalogo_idx'),
+            models.Index(fields=['disponible', 'precio_final', 'id'], name='product_precio_idx'),
+            # MAX(modificado) para los ETag del catálogo, ver product/validadores.py
+            models.Index(fields=['modificado'], name='product_modificado_idx'),
+        ]
         verbose_name = "Producto"
         verbose_name_plural = "Productos"
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.nombre)[:240]
+        self.precio_final = self.calcular_precio_final()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'precio', 'oferta'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'precio_final'}
         super().save(*args, **kwargs)
 
-    @property
-    def precio_final(self):
+    def calcular_precio_final(self):
+        precio = Decimal(str(self.precio))
         if self.oferta:
-            descuento = (self.oferta / Decimal('100')) * self.precio
-            return (self.precio - descuento).quantize(Decimal('0.01'))
-        return self.precio
+            descuento = (Decimal(str(self.oferta)) / Decimal('100')) * precio
+            return (precio - descuento).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        return precio.quantize(Decimal('0.01'))
+
+    @property
+    def tallas_en_stock(self):
+        return [talla for i, talla in enumerate(TALLAS_ESTANDAR) if self.tallas_disponibles >> i & 1]
 
     def imagen_principal(self):
         img = self.imagenes.filter(es_principal=True).first()
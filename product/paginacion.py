@@ -0,0 +1,90 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class PaginaCursor:
+    """Página de una paginación por cursor: sin COUNT(*) ni OFFSET."""
+
+    def __init__(self, object_list, siguiente):
+        self.object_list = object_list
+        self.siguiente = siguiente
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.siguiente is not None
+
+
+def _codificar(valores):
+    valores = [
+        valor.isoformat() if isinstance(valor, datetime) else str(valor) if isinstance(valor, Decimal) else valor
+        for valor in valores
+    ]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+
+def _decodificar(cursor, campos):
+    valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(valores, list) or len(valores) != len(campos):
+        raise ValueError('Cursor no válido')
+    return valores
+
+
+def _convertir(queryset, campo, valor):
+    """Valor del cursor con el tipo del campo de orden (columna o anotación, p. ej. la relevancia)."""
+    if campo in queryset.query.annotations:
+        return queryset.query.annotations[campo].output_field.to_python(valor)
+    opciones = queryset.model._meta
+    return (opciones.pk if campo == 'pk' else opciones.get_field(campo)).to_python(valor)
+
+
+def _posteriores(orden, valores):
+    """Filas que van después del cursor: a > a0 OR (a = a0 AND (b > b0 OR ...)), según el sentido de cada campo."""
+    condicion = None
+    for campo, valor in reversed(list(zip(orden, valores))):
+        nombre = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        estricta = Q(**{f'{nombre}__{operador}': valor})
+        condicion = estricta if condicion is None else estricta | (Q(**{nombre: valor}) & condicion)
+    return condicion
+
+
+def paginar_por_cursor(queryset, cursor=None, tamano=12):
+    """
+    Página de `queryset` que sigue a `cursor`, respetando su orden actual (o el de Meta)
+    con `-id` como desempate. Cada página es una sola consulta
+    `WHERE (creado, id) < (...) ORDER BY creado DESC, id DESC LIMIT tamano + 1`,
+    igual de rápida en la primera página que en la última.
+    """
+    orden = list(queryset.query.order_by or queryset.model._meta.ordering)
+    if orden[-1].lstrip('-') not in ('id', 'pk'):
+        orden.append('-id')
+    campos = [campo.lstrip('-') for campo in orden]
+    queryset = queryset.order_by(*orden)
+
+    if cursor:
+        try:
+            valores = [_convertir(queryset, campo, valor) for campo, valor in zip(campos, _decodificar(cursor, campos))]
+        except (ValueError, TypeError, binascii.Error, ValidationError, FieldDoesNotExist):
+            valores = None
+        if valores:
+            queryset = queryset.filter(_posteriores(orden, valores))
+
+    filas = list(queryset[:tamano + 1])
+    siguiente = None
+    if len(filas) > tamano:
+        filas = filas[:tamano]
+        ultima = filas[-1]
+        # Filas de modelo o diccionarios de values()
+        siguiente = _codificar([ultima[campo] if isinstance(ultima, dict) else getattr(ultima, campo) for campo in campos])
+    return PaginaCursor(filas, siguiente)
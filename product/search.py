@@ -0,0 +1,121 @@
+"""
+Búsqueda de texto completo sobre productos (nombre, marca, color, material y descripción).
+
+- PostgreSQL: columna `search_vector` (tsvector con la configuración 'spanish') con índice
+  GIN; los resultados se ordenan por SearchRank.
+- SQLite (settings_test): tabla virtual FTS5 `product_busqueda`, ordenada por bm25.
+- Otros motores: icontains sobre los mismos campos.
+
+El índice se actualiza al guardar un producto o una marca y se reconstruye entero
+con `manage.py reindexar_busqueda`.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q, FloatField
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product, Brand
+
+CONFIG = 'spanish'
+TABLA_FTS = 'product_busqueda'
+
+# Pesos: el nombre y la marca pesan más que color/material, y estos más que la descripción
+_VECTOR_PG = """
+    setweight(to_tsvector('spanish', coalesce(p.nombre, '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce((SELECT b.nombre FROM product_brand b WHERE b.id = p.marca_id), '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce(p.color, '') || ' ' || coalesce(p.material, '')), 'B') ||
+    setweight(to_tsvector('spanish', coalesce(p.descripcion, '')), 'C')
+"""
+_PESOS_FTS = '10.0, 8.0, 4.0, 4.0, 1.0'
+
+
+def actualizar_indice(ids=None):
+    """Recalcula la entrada de búsqueda de los productos `ids` (de todos si es None)."""
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            sql = f'UPDATE product_product p SET search_vector = {_VECTOR_PG}'
+            if ids is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql + ' WHERE p.id = ANY(%s)', [ids])
+
+        elif connection.vendor == 'sqlite':
+            filtro, params = '', []
+            if ids is not None:
+                filtro, params = f" WHERE p.id IN ({', '.join(['%s'] * len(ids))})", ids
+            cursor.execute(f'DELETE FROM {TABLA_FTS}' + filtro.replace('p.id', 'rowid'), params)
+            cursor.execute(
+                f'INSERT INTO {TABLA_FTS} (rowid, nombre, marca, color, material, descripcion) '
+                f"SELECT p.id, p.nombre, coalesce(b.nombre, ''), p.color, p.material, p.descripcion "
+                f'FROM product_product p LEFT JOIN product_brand b ON b.id = p.marca_id' + filtro,
+                params,
+            )
+
+
+def buscar(queryset, texto):
+    """Filtra `queryset` de productos por `texto` y lo ordena por relevancia."""
+    texto = (texto or '').strip()
+    if not texto:
+        return queryset
+
+    if connection.vendor == 'postgresql':
+        consulta = SearchQuery(texto, config=CONFIG, search_type='websearch')
+        return (
+            queryset.filter(search_vector=consulta)
+            .annotate(relevancia=SearchRank(F('search_vector'), consulta))
+            .order_by('-relevancia', '-creado')
+        )
+
+    if connection.vendor == 'sqlite':
+        terminos = re.findall(r'\w+', texto)
+        if not terminos:
+            return queryset.none()
+        # Cada término como prefijo ("zapat"*), todos obligatorios
+        consulta = ' '.join(f'"{termino}"*' for termino in terminos)
+        # Filtro y relevancia van dentro de la consulta del catálogo, sin traer los ids a
+        # Python: la paginación y las facetas ven todas las coincidencias
+        coincidencias = RawSQL(f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s', [consulta])
+        relevancia = RawSQL(
+            f'SELECT -bm25({TABLA_FTS}, {_PESOS_FTS}) FROM {TABLA_FTS} '
+            f'WHERE {TABLA_FTS} MATCH %s AND rowid = "product_product"."id"',
+            [consulta], output_field=FloatField(),
+        )
+        return (
+            queryset.filter(pk__in=coincidencias)
+            .annotate(relevancia=relevancia)
+            .order_by('-relevancia', '-creado')
+        )
+
+    return queryset.filter(
+        Q(nombre__icontains=texto) | Q(descripcion__icontains=texto) | Q(color__icontains=texto)
+        | Q(material__icontains=texto) | Q(marca__nombre__icontains=texto)
+    )
+
+
+@receiver(post_save, sender=Product)
+def _indexar_producto(sender, instance, raw=False, **kwargs):
+    if not raw:
+        actualizar_indice([instance.pk])
+
+
+@receiver(post_save, sender=Brand)
+def _indexar_productos_de_marca(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        actualizar_indice(instance.productos.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def _desindexar_producto(sender, instance, **kwargs):
+    # En PostgreSQL el vector se borra con la fila; la tabla FTS5 va aparte
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLA_FTS} WHERE rowid = %s', [instance.pk])
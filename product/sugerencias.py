@@ -0,0 +1,116 @@
+"""
+Índice en memoria para autocompletar el buscador (productos, marcas y categorías).
+
+Es un array ordenado de claves normalizadas (sin acentos, en minúsculas) que se consulta
+con búsqueda binaria, así que cada pulsación no toca la base de datos. Cada proceso
+reconstruye su índice cuando cambia la versión del catálogo (se incrementa en la caché
+al guardar o borrar un producto, marca o categoría) o, como red de seguridad si la caché
+no se comparte entre procesos, cada SUGERENCIAS_REFRESCO_SEGUNDOS.
+"""
+import bisect
+import time
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Product, Brand, Category
+
+CLAVE_VERSION = 'product:sugerencias_version'
+# Hora de la última subida de versión, para el Last-Modified del catálogo (product/validadores.py)
+CLAVE_CAMBIO = 'product:catalogo_cambio'
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos: 'Montaña' -> 'montana'."""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).strip()
+
+
+class IndicePrefijos:
+    """
+    Array ordenado de (clave, posición) donde la clave es el texto normalizado a partir
+    de cada palabra, para que 'mon' encuentre también 'Bota Montaña'.
+    """
+
+    def __init__(self, entradas):
+        self.entradas = entradas
+        claves = []
+        for posicion, (tipo, etiqueta, url) in enumerate(entradas):
+            palabras = normalizar(etiqueta).split()
+            for i in range(len(palabras)):
+                claves.append((' '.join(palabras[i:]), posicion))
+        claves.sort()
+        self._claves = [clave for clave, _ in claves]
+        self._posiciones = [posicion for _, posicion in claves]
+
+    def buscar(self, prefijo, limite):
+        """Hasta `limite` entradas por tipo cuyo texto tiene alguna palabra que empieza por `prefijo`."""
+        prefijo = normalizar(prefijo)
+        resultado = {'productos': [], 'marcas': [], 'categorias': []}
+        if not prefijo:
+            return resultado
+
+        vistos = set()
+        i = bisect.bisect_left(self._claves, prefijo)
+        while i < len(self._claves) and self._claves[i].startswith(prefijo):
+            posicion = self._posiciones[i]
+            i += 1
+            if posicion in vistos:
+                continue
+            vistos.add(posicion)
+            tipo, etiqueta, url = self.entradas[posicion]
+            if len(resultado[tipo]) < limite:
+                resultado[tipo].append({'nombre': etiqueta, 'url': url})
+        return resultado
+
+
+_indice = None
+_version = None
+_construido = 0.0
+
+
+def _construir():
+    lista = reverse('product:product_list')
+    entradas = [
+        ('productos', nombre, reverse('product:product_detail', args=[slug]))
+        for nombre, slug in Product.objects.filter(disponible=True).values_list('nombre', 'slug')
+    ]
+    entradas += [('marcas', nombre, f'{lista}?marca={slug}') for nombre, slug in Brand.objects.values_list('nombre', 'slug')]
+    entradas += [('categorias', nombre, f'{lista}?categoria={slug}') for nombre, slug in Category.objects.values_list('nombre', 'slug')]
+    return IndicePrefijos(entradas)
+
+
+def get_indice():
+    """Índice del proceso, reconstruido solo si el catálogo ha cambiado o ha caducado."""
+    global _indice, _version, _construido
+    version = cache.get(CLAVE_VERSION, 0)
+    caducado = time.monotonic() - _construido > settings.SUGERENCIAS_REFRESCO_SEGUNDOS
+    if _indice is None or version != _version or caducado:
+        _indice, _version, _construido = _construir(), version, time.monotonic()
+    return _indice
+
+
+def sugerir(prefijo, limite=5):
+    return get_indice().buscar(prefijo, limite)
+
+
+def invalidar():
+    """Marca el índice como obsoleto en todos los procesos que compartan la caché."""
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.set(CLAVE_VERSION, 1, timeout=None)
+    cache.set(CLAVE_CAMBIO, timezone.now(), timeout=None)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Brand)
+@receiver([post_save, post_delete], sender=Category)
+def _catalogo_modificado(sender, **kwargs):
+    if not kwargs.get('raw'):
+        invalidar()
@@ -0,0 +1,57 @@
+"""
+Máscara de tallas con stock en `Product.tallas_disponibles` (bit i = TALLAS_ESTANDAR[i]),
+para filtrar el catálogo por talla sin unir ProductSize en cada listado.
+
+Se recalcula con un único UPDATE por lote de productos al guardar o borrar una talla y
+desde pedido/stock.py, que mueve el stock de las tallas con UPDATE directos sin señales.
+Las tallas fuera de TALLAS_ESTANDAR no cuentan para el filtro.
+"""
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When, IntegerField
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Product, ProductSize, TALLAS_ESTANDAR
+
+
+def bit_talla(talla):
+    """Bit de `talla` en la máscara, 0 si no es una talla estándar."""
+    return 1 << TALLAS_ESTANDAR.index(talla) if talla in TALLAS_ESTANDAR else 0
+
+
+def mascara_subquery(modelo_talla=ProductSize):
+    # (producto, talla) es única, así que sumar los bits equivale a un OR
+    bits = Case(
+        *[When(talla=talla, then=Value(bit_talla(talla))) for talla in TALLAS_ESTANDAR],
+        default=Value(0), output_field=IntegerField(),
+    )
+    return Coalesce(
+        Subquery(
+            modelo_talla.objects.filter(producto=OuterRef('pk'), stock__gt=0)
+            .order_by().values('producto').annotate(mascara=Sum(bits)).values('mascara')[:1]
+        ),
+        Value(0),
+    )
+
+
+def actualizar_tallas_disponibles(producto_ids=None):
+    productos = Product.objects.all() if producto_ids is None else Product.objects.filter(pk__in=producto_ids)
+    # Solo cambian las filas cuya máscara cambia; `modificado` avisa a cachés y ETag del catálogo
+    return productos.exclude(tallas_disponibles=mascara_subquery()).update(
+        tallas_disponibles=mascara_subquery(), modificado=timezone.now(),
+    )
+
+
+def filtrar_por_talla(productos, talla):
+    """Productos con stock en `talla`: un AND de bits sobre la propia fila de Product."""
+    bit = bit_talla(talla)
+    if not bit:
+        return productos.none()
+    return productos.alias(tiene_talla=F('tallas_disponibles').bitand(bit)).filter(tiene_talla__gt=0)
+
+
+@receiver([post_save, post_delete], sender=ProductSize)
+def _talla_modificada(sender, instance, raw=False, **kwargs):
+    if not raw:
+        actualizar_tallas_disponibles([instance.producto_id])
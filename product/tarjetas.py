@@ -0,0 +1,56 @@
+"""
+Caché de fragmentos de las tarjetas de producto (catálogo, portada y relacionados).
+
+Cada tarjeta se guarda bajo una clave con el id del producto, su fecha de modificación,
+su imagen principal y sus tallas con stock, así que nunca hace falta borrar nada: cuando
+el producto cambia la clave deja de usarse y la entrada antigua caduca sola. Guardar o
+borrar una imagen (product/imagenes.py), o renombrar una marca, actualiza `modificado`
+de los productos afectados y solo de ellos.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .models import Brand
+
+
+def clave_tarjeta(producto, plantilla):
+    imagen = hashlib.md5(producto.imagen_url.encode()).hexdigest()[:12]
+    # Las tallas con stock cambian con las compras sin tocar `modificado`
+    return (
+        f'product:tarjeta:{plantilla}:{producto.pk}:{producto.modificado.timestamp()}'
+        f':{imagen}:{producto.tallas_disponibles}'
+    )
+
+
+def tarjetas(productos, plantilla='product_card.html'):
+    """
+    HTML de la tarjeta de cada producto, en el mismo orden. Las que ya están en caché se
+    leen con un solo get_many y las que faltan se renderizan y se guardan con set_many.
+    """
+    productos = list(productos)
+    claves = [clave_tarjeta(producto, plantilla) for producto in productos]
+    en_cache = cache.get_many(claves)
+
+    nuevas = {
+        clave: render_to_string(plantilla, {'producto': producto})
+        for clave, producto in zip(claves, productos)
+        if clave not in en_cache
+    }
+    if nuevas:
+        cache.set_many(nuevas, settings.TARJETAS_CACHE_SEGUNDOS)
+    en_cache.update(nuevas)
+    return [mark_safe(en_cache[clave]) for clave in claves]
+
+
+@receiver(post_save, sender=Brand)
+def _marca_modificada(sender, instance, created, raw=False, **kwargs):
+    # La tarjeta muestra el nombre de la marca
+    if not raw and not created:
+        instance.productos.update(modificado=timezone.now())
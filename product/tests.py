@@ -1,8 +1,23 @@
 from django.test import TestCase
 from django.urls import reverse
 from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-from .models import Product, Category, Brand, ProductImage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import detalle, sugerencias
+from .models import Product, Category, Brand, ProductImage, ProductSize
+from .paginacion import paginar_por_cursor
+from .search import actualizar_indice, buscar
+from .tarjetas import tarjetas
 
 
 class ProductModelTests(TestCase):
@@ -99,3 +114,563 @@ class ProductViewsTests(TestCase):
 		related_ids = [r.id for r in related]
 		self.assertIn(self.p2.id, related_ids)
 
+
+
+class ProductSearchTests(TestCase):
+	def setUp(self):
+		marca = Brand.objects.create(nombre='Camper')
+		self.bota = Product.objects.create(
+			nombre='Bota Montaña', precio=Decimal('90.00'), stock=3, marca=marca,
+			color='Marrón', material='Piel', descripcion='Impermeable y cómoda',
+		)
+		self.sandalia = Product.objects.create(
+			nombre='Sandalia Playa', precio=Decimal('20.00'), stock=3,
+			color='Azul', material='Goma', descripcion='Ideal para la montaña en verano',
+		)
+
+	def _buscar(self, texto):
+		response = self.client.get(reverse('product:product_list'), {'search': texto})
+		return [p.nombre for p in response.context['page_obj']]
+
+	def test_busca_en_marca_color_material_y_descripcion(self):
+		self.assertEqual(self._buscar('camper'), ['Bota Montaña'])
+		self.assertEqual(self._buscar('goma azul'), ['Sandalia Playa'])
+		self.assertEqual(self._buscar('impermeable'), ['Bota Montaña'])
+		self.assertEqual(self._buscar('nada parecido'), [])
+
+	def test_ordena_por_relevancia(self):
+		# The name weighs more than the description
+		self.assertEqual(self._buscar('montaña'), ['Bota Montaña', 'Sandalia Playa'])
+
+	def test_indice_se_actualiza_al_guardar_y_se_reconstruye(self):
+		self.sandalia.nombre = 'Chancla Playa'
+		self.sandalia.save()
+		self.assertEqual(self._buscar('chancla'), ['Chancla Playa'])
+
+		Product.objects.filter(pk=self.bota.pk).update(nombre='Botín Montaña')
+		self.assertEqual(self._buscar('botín'), [])
+		call_command('reindexar_busqueda', stdout=StringIO())
+		self.assertEqual(self._buscar('botín'), ['Botín Montaña'])
+
+	def test_no_hay_tope_de_resultados(self):
+		Product.objects.bulk_create(
+			Product(nombre=f'Zapatilla Running {i}', slug=f'zapatilla-running-{i}', precio=Decimal('30.00'))
+			for i in range(1005)
+		)
+		actualizar_indice()
+		response = self.client.get(reverse('product:product_list'), {'search': 'running', 'formato': 'json', 'total': 1})
+		self.assertEqual(response.json()['total'], 1005)
+		segunda = self.client.get(response.json()['siguiente'] + '&formato=json')
+		self.assertIn('Zapatilla Running', segunda.json()['html'])
+		# The cursor also walks past the first thousand matches
+		resultados = buscar(Product.objects.all(), 'running')
+		self.assertEqual(len(paginar_por_cursor(resultados, None, 2000)), 1005)
+
+
+class ProductSuggestionTests(TestCase):
+	def setUp(self):
+		self.marca = Brand.objects.create(nombre='Montaraz')
+		Category.objects.create(nombre='Botas')
+		Product.objects.create(nombre='Bota Montaña', precio=Decimal('90.00'), stock=3, marca=self.marca)
+		Product.objects.create(nombre='Botín Urbano', precio=Decimal('60.00'), stock=3)
+
+	def test_sugiere_productos_marcas_y_categorias_por_prefijo(self):
+		data = self.client.get(reverse('product:sugerencias'), {'q': 'mont'}).json()
+		self.assertEqual([s['nombre'] for s in data['productos']], ['Bota Montaña'])
+		self.assertEqual([s['nombre'] for s in data['marcas']], ['Montaraz'])
+
+		data = self.client.get(reverse('product:sugerencias'), {'q': 'BOT'}).json()
+		self.assertEqual(sorted(s['nombre'] for s in data['productos']), ['Bota Montaña', 'Botín Urbano'])
+		self.assertEqual(data['categorias'][0]['url'], reverse('product:product_list') + '?categoria=botas')
+
+	def test_sugerencias_no_consultan_la_bd_hasta_que_cambia_el_catalogo(self):
+		self.client.get(reverse('product:sugerencias'), {'q': 'bo'})
+		with self.assertNumQueries(0):
+			self.client.get(reverse('product:sugerencias'), {'q': 'bot'})
+
+		Product.objects.create(nombre='Bolso Viaje', precio=Decimal('30.00'), stock=1)
+		data = self.client.get(reverse('product:sugerencias'), {'q': 'bol'}).json()
+		self.assertEqual([s['nombre'] for s in data['productos']], ['Bolso Viaje'])
+
+	def test_producto_con_slug_sugerencias_tiene_ficha(self):
+		Product.objects.create(nombre='Sugerencias', precio=Decimal('10.00'), stock=1)
+		response = self.client.get(reverse('product:product_detail', args=['sugerencias']))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.context['product'].nombre, 'Sugerencias')
+
+
+class ProductFacetTests(TestCase):
+	def setUp(self):
+		botas = Category.objects.create(nombre='Botas')
+		deportivas = Category.objects.create(nombre='Deportivas')
+		self.marca = Brand.objects.create(nombre='Camper')
+		Product.objects.create(nombre='Bota A', precio=Decimal('50.00'), categoria=botas, marca=self.marca, color='Negro', material='Piel', genero='M')
+		Product.objects.create(nombre='Bota B', precio=Decimal('50.00'), categoria=botas, color='Marrón', material='Piel', genero='F')
+		Product.objects.create(nombre='Zapatilla', precio=Decimal('40.00'), categoria=deportivas, marca=self.marca, color='Negro', material='Tela')
+		Product.objects.create(nombre='Oculta', precio=Decimal('40.00'), categoria=deportivas, color='Rojo', disponible=False)
+
+	def _facetas(self, **filtros):
+		response = self.client.get(reverse('product:product_list'), filtros)
+		return {
+			faceta: {opcion['valor']: opcion['total'] for opcion in opciones}
+			for faceta, opciones in response.context['facetas'].items()
+		}
+
+	def test_recuentos_sin_filtros(self):
+		facetas = self._facetas()
+		self.assertEqual(facetas['categoria'], {'botas': 2, 'deportivas': 1})
+		self.assertEqual(facetas['color'], {'Negro': 2, 'Marrón': 1})
+		self.assertEqual(facetas['material'], {'Piel': 2, 'Tela': 1})
+		self.assertEqual(facetas['marca'], {'camper': 2})
+
+	def test_cada_faceta_aplica_los_filtros_de_las_demas(self):
+		facetas = self._facetas(categoria='botas', color='Negro')
+		# Category counts ignore the category filter but honour the colour one
+		self.assertEqual(facetas['categoria'], {'botas': 1, 'deportivas': 1})
+		self.assertEqual(facetas['color'], {'Negro': 1, 'Marrón': 1})
+		self.assertEqual(facetas['genero'], {'M': 1})
+
+	def test_facetas_en_una_sola_consulta(self):
+		self.client.get(reverse('product:product_list'))
+		with CaptureQueriesContext(connection) as ctx:
+			self.client.get(reverse('product:product_list'), {'categoria': 'botas'})
+		agrupadas = [q['sql'] for q in ctx.captured_queries if 'GROUP BY' in q['sql']]
+		self.assertEqual(len(agrupadas), 1)
+
+
+class ProductCursorPaginationTests(TestCase):
+	def setUp(self):
+		# Same timestamp for every product so the id tiebreaker decides the order
+		creado = timezone.now()
+		for i in range(15):
+			Product.objects.create(nombre=f'Zapato {i:02d}', precio=Decimal('30.00'), creado=creado)
+
+	def _recorrer(self, **filtros):
+		url, nombres, paginas = reverse('product:product_list'), [], 0
+		params = filtros
+		while True:
+			response = self.client.get(url, params)
+			nombres += [p.nombre for p in response.context['page_obj']]
+			paginas += 1
+			if not response.context['siguiente_query']:
+				return nombres, paginas
+			params = QueryDict(response.context['siguiente_query'])
+
+	def test_recorre_todas_las_paginas_sin_repetir(self):
+		nombres, paginas = self._recorrer()
+		self.assertEqual(paginas, 2)
+		self.assertEqual(nombres, [f'Zapato {i:02d}' for i in reversed(range(15))])
+
+	def test_cursor_con_busqueda(self):
+		nombres, paginas = self._recorrer(search='zapato')
+		self.assertEqual(paginas, 2)
+		self.assertEqual(sorted(nombres), [f'Zapato {i:02d}' for i in range(15)])
+
+	def test_sin_count(self):
+		with CaptureQueriesContext(connection) as ctx:
+			self.client.get(reverse('product:product_list'))
+		self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql'] and 'GROUP BY' not in q['sql']])
+
+	def test_variante_json_para_scroll_infinito(self):
+		data = self.client.get(reverse('product:product_list'), {'formato': 'json'}).json()
+		self.assertIn('Zapato 14', data['html'])
+		self.assertNotIn('total', data)
+		self.assertIn('cursor=', data['siguiente'])
+		self.assertNotIn('formato', data['siguiente'])
+
+		siguiente = QueryDict(data['siguiente'].split('?', 1)[1]).dict()
+		data = self.client.get(reverse('product:product_list'), {**siguiente, 'formato': 'json', 'total': '1'}).json()
+		self.assertIn('Zapato 00', data['html'])
+		self.assertNotIn('Zapato 14', data['html'])
+		self.assertIsNone(data['siguiente'])
+		self.assertEqual(data['total'], 15)
+
+	def test_cursor_invalido_vuelve_al_principio(self):
+		response = self.client.get(reverse('product:product_list'), {'cursor': 'basura'})
+		self.assertEqual(response.context['page_obj'].object_list[0].nombre, 'Zapato 14')
+
+	def test_variante_json_no_calcula_facetas(self):
+		with CaptureQueriesContext(connection) as ctx:
+			self.client.get(reverse('product:product_list'), {'formato': 'json'})
+		self.assertFalse([q for q in ctx.captured_queries if 'GROUP BY' in q['sql']])
+
+	def test_cursor_convierte_cada_valor_segun_su_campo(self):
+		# Text that looks like a date must stay text for a text ordering field
+		for nombre in ('2024-01-01 10:00', '2024-01-02 10:00', '2024-01-03 10:00'):
+			Product.objects.create(nombre=nombre, precio=Decimal('30.00'))
+		productos = Product.objects.filter(nombre__startswith='2024').order_by('nombre')
+		pagina = paginar_por_cursor(productos, None, 1)
+		pagina = paginar_por_cursor(productos, pagina.siguiente, 1)
+		self.assertEqual([p.nombre for p in pagina], ['2024-01-02 10:00'])
+
+
+class ProductCardCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.p1 = Product.objects.create(nombre='Bota Cacheada', precio=Decimal('50.00'))
+		self.p2 = Product.objects.create(nombre='Zapatilla Cacheada', precio=Decimal('40.00'))
+
+	def _productos(self):
+		return Product.objects.filter(pk__in=[self.p1.pk, self.p2.pk]).select_related('marca')
+
+	def test_tarjetas_salen_de_la_cache_con_un_get_many(self):
+		primeras = tarjetas(self._productos())
+		with mock.patch('product.tarjetas.render_to_string') as render, \
+				mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+			self.assertEqual(tarjetas(self._productos()), primeras)
+		render.assert_not_called()
+		self.assertEqual(get_many.call_count, 1)
+
+	def test_guardar_una_imagen_solo_invalida_su_producto(self):
+		tarjetas(self._productos())
+		ProductImage.objects.create(producto=self.p1, imagen='https://example.com/nueva.jpg', es_principal=True)
+		with mock.patch('product.tarjetas.render_to_string', return_value='<div></div>') as render:
+			tarjetas(self._productos())
+		self.assertEqual([c.args[1]['producto'].pk for c in render.call_args_list], [self.p1.pk])
+
+	def test_listado_muestra_el_producto_modificado(self):
+		self.client.get(reverse('product:product_list'))
+		self.p1.nombre = 'Bota Renombrada'
+		self.p1.save()
+		response = self.client.get(reverse('product:product_list'))
+		self.assertContains(response, 'Bota Renombrada')
+		self.assertContains(response, 'Zapatilla Cacheada')
+
+
+class ProductImageUrlTests(TestCase):
+	def setUp(self):
+		self.p = Product.objects.create(nombre='Con Fotos', precio=Decimal('10.00'))
+
+	def _imagen_url(self):
+		return Product.objects.values_list('imagen_url', flat=True).get(pk=self.p.pk)
+
+	def test_imagen_url_sigue_a_la_principal(self):
+		self.assertEqual(self._imagen_url(), '')
+		segunda = ProductImage.objects.create(producto=self.p, imagen='http://img/2.jpg', orden=2)
+		ProductImage.objects.create(producto=self.p, imagen='http://img/1.jpg', orden=1)
+		self.assertEqual(self._imagen_url(), 'http://img/1.jpg')
+
+		segunda.es_principal = True
+		segunda.save()
+		self.assertEqual(self._imagen_url(), 'http://img/2.jpg')
+		segunda.delete()
+		self.assertEqual(self._imagen_url(), 'http://img/1.jpg')
+
+	def test_comando_rellena_imagen_url(self):
+		ProductImage.objects.create(producto=self.p, imagen='http://img/1.jpg')
+		Product.objects.filter(pk=self.p.pk).update(imagen_url='')
+		call_command('rellenar_imagenes', stdout=StringIO())
+		self.assertEqual(self._imagen_url(), 'http://img/1.jpg')
+
+	def test_listado_no_consulta_imagenes(self):
+		ProductImage.objects.create(producto=self.p, imagen='http://img/1.jpg')
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(reverse('product:product_list'))
+		self.assertContains(response, 'http://img/1.jpg')
+		self.assertFalse([q for q in ctx.captured_queries if '"product_productimage"' in q['sql']])
+
+
+class ProductDetailCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.categoria = Category.objects.create(nombre='Botas')
+		self.p = Product.objects.create(nombre='Bota Ficha', precio=Decimal('70.00'), stock=4, categoria=self.categoria)
+		self.talla = ProductSize.objects.create(producto=self.p, talla='42', stock=2)
+		Product.objects.create(nombre='Bota Vecina', precio=Decimal('60.00'), categoria=self.categoria)
+		self.url = reverse('product:product_detail', args=[self.p.slug])
+
+	def test_segunda_visita_solo_relee_el_stock(self):
+		self.client.get(self.url)
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(self.url)
+		self.assertContains(response, 'Bota Vecina')
+		tablas = ('"product_productimage"', '"product_category"', '"product_brand"')
+		self.assertFalse([q for q in ctx.captured_queries if any(t in q['sql'] for t in tablas)])
+
+		# Purchases change stock with plain UPDATEs: the page must not show the cached value
+		ProductSize.objects.filter(pk=self.talla.pk).update(stock=1)
+		Product.objects.filter(pk=self.p.pk).update(stock=3)
+		response = self.client.get(self.url)
+		self.assertContains(response, '(¡Últimas 1!)')
+		self.assertContains(response, 'Stock disponible: 3')
+
+	def test_se_invalida_al_guardar(self):
+		self.client.get(self.url)
+		self.categoria.nombre = 'Botines'
+		self.categoria.save()
+		self.p.descripcion = 'Nueva descripción'
+		self.p.save()
+		self.assertContains(self.client.get(self.url), 'Nueva descripción')
+
+		self.p.disponible = False
+		self.p.save()
+		self.assertEqual(self.client.get(self.url).status_code, 404)
+
+	def test_un_cambio_solo_descarta_las_fichas_que_lo_pintan(self):
+		otra_categoria = Category.objects.create(nombre='Sandalias')
+		ajena = Product.objects.create(nombre='Sandalia Ajena', precio=Decimal('20.00'), categoria=otra_categoria)
+		url_ajena = reverse('product:product_detail', args=[ajena.slug])
+		self.client.get(self.url)
+		self.client.get(url_ajena)
+
+		vecina = Product.objects.get(nombre='Bota Vecina')
+		vecina.nombre = 'Bota Vecina Renombrada'
+		vecina.save()
+		with mock.patch('product.detalle._calcular', wraps=detalle._calcular) as calcular:
+			# The related card is refreshed on this page, the unrelated page stays cached
+			self.assertContains(self.client.get(self.url), 'Bota Vecina Renombrada')
+			self.client.get(url_ajena)
+		calcular.assert_called_once_with(self.p.slug)
+
+	def test_slug_renombrado_deja_de_servirse(self):
+		self.client.get(self.url)
+		self.p.slug = 'bota-ficha-nueva'
+		self.p.save()
+		self.assertEqual(self.client.get(self.url).status_code, 404)
+
+	def test_caducada_con_recalculo_en_curso_sirve_la_copia(self):
+		self.client.get(self.url)
+		clave = f'product:detalle:{self.p.slug}'
+		datos, ids, calculado, _ = cache.get(clave)
+		cache.set(clave, (datos, ids, calculado, 0), 60)
+		# Another worker holds the lock: this one keeps serving the stale copy
+		cache.add(f'{clave}:bloqueo', 1, 60)
+		with mock.patch('product.detalle._calcular') as calcular:
+			self.assertEqual(self.client.get(self.url).status_code, 200)
+		calcular.assert_not_called()
+
+
+class ProductSizeFilterTests(TestCase):
+	def setUp(self):
+		self.bota = Product.objects.create(nombre='Bota Tallas', precio=Decimal('80.00'))
+		self.talla42 = ProductSize.objects.create(producto=self.bota, talla='42', stock=1)
+		ProductSize.objects.create(producto=self.bota, talla='38', stock=0)
+		ProductSize.objects.create(producto=self.bota, talla='42.5', stock=3)
+		self.zapatilla = Product.objects.create(nombre='Zapatilla Tallas', precio=Decimal('50.00'))
+		ProductSize.objects.create(producto=self.zapatilla, talla='38', stock=2)
+
+	def _listado(self, talla):
+		response = self.client.get(reverse('product:product_list'), {'talla': talla})
+		return [p.nombre for p in response.context['page_obj']]
+
+	def test_mascara_refleja_tallas_con_stock(self):
+		self.bota.refresh_from_db()
+		self.assertEqual(self.bota.tallas_en_stock, ['42'])
+		self.assertEqual(self._listado('42'), ['Bota Tallas'])
+		self.assertEqual(self._listado('38'), ['Zapatilla Tallas'])
+		self.assertEqual(self._listado('44'), [])
+
+	def test_mascara_sigue_al_stock_de_los_pedidos(self):
+		from pedido.stock import reservar_stock, devolver_stock_lineas
+		self.assertTrue(reservar_stock(self.bota.pk, '42', 1))
+		self.assertEqual(self._listado('42'), [])
+		devolver_stock_lineas([(self.bota.pk, '42', 1)])
+		self.assertEqual(self._listado('42'), ['Bota Tallas'])
+
+	def test_filtro_no_une_tallas_y_la_tarjeta_las_muestra(self):
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(reverse('product:product_list'), {'talla': '42'})
+		self.assertFalse([q for q in ctx.captured_queries if '"product_productsize"' in q['sql']])
+		self.assertContains(response, '<span class="badge bg-light text-dark border me-1">42</span>', html=True)
+
+
+class ProductPriceTests(TestCase):
+	def setUp(self):
+		self.cara = Product.objects.create(nombre='Cara', precio=Decimal('120.00'), oferta=Decimal('50.00'))
+		self.media = Product.objects.create(nombre='Media', precio=Decimal('80.00'))
+		self.barata = Product.objects.create(nombre='Barata', precio=Decimal('30.00'))
+
+	def _listado(self, **params):
+		response = self.client.get(reverse('product:product_list'), params)
+		return [p.nombre for p in response.context['page_obj']]
+
+	def test_precio_final_sigue_a_las_actualizaciones_masivas(self):
+		Product.objects.filter(pk=self.media.pk).update(oferta=Decimal('25.00'))
+		Product.objects.filter(pk=self.barata.pk).update(precio=F('precio') * 2)
+		self.cara.precio = Decimal('100.00')
+		Product.objects.bulk_update([self.cara], ['precio'])
+		precios = dict(Product.objects.values_list('nombre', 'precio_final'))
+		self.assertEqual(precios, {'Cara': Decimal('50.00'), 'Media': Decimal('60.00'), 'Barata': Decimal('60.00')})
+
+		self.cara.oferta = None
+		self.cara.save(update_fields=['oferta'])
+		self.cara.refresh_from_db()
+		self.assertEqual(self.cara.precio_final, Decimal('100.00'))
+
+	def test_tarjetas_y_ficha_muestran_el_precio_tras_actualizaciones_masivas(self):
+		cache.clear()
+		self.assertIn('80,00', tarjetas([self.media])[0])
+		url = reverse('product:product_detail', args=[self.media.slug])
+		self.client.get(url)
+
+		Product.objects.filter(pk=self.media.pk).update(precio=Decimal('50.00'))
+		self.media.refresh_from_db()
+		self.assertIn('50,00', tarjetas([self.media])[0])
+		self.assertContains(self.client.get(url), '50,00')
+
+		self.media.oferta = Decimal('10.00')
+		Product.objects.bulk_update([self.media], ['oferta'])
+		self.assertIn('45,00', tarjetas([self.media])[0])
+		self.assertContains(self.client.get(url), '45,00')
+
+	def test_ordena_y_filtra_por_precio_de_venta(self):
+		self.assertEqual(self._listado(orden='precio'), ['Barata', 'Cara', 'Media'])
+		self.assertEqual(self._listado(orden='-precio'), ['Media', 'Cara', 'Barata'])
+		self.assertEqual(self._listado(precio_min='50', precio_max='70'), ['Cara'])
+		self.assertEqual(self._listado(precio_min='no-es-un-numero', orden='precio'), ['Barata', 'Cara', 'Media'])
+
+	def test_cursor_con_orden_por_precio(self):
+		for i in range(12):
+			Product.objects.create(nombre=f'Relleno {i}', precio=Decimal('45.00'))
+		response = self.client.get(reverse('product:product_list'), {'orden': 'precio'})
+		siguiente = self.client.get(reverse('product:product_list') + '?' + response.context['siguiente_query'])
+		nombres = [p.nombre for p in response.context['page_obj']] + [p.nombre for p in siguiente.context['page_obj']]
+		self.assertEqual(len(set(nombres)), 15)
+		self.assertEqual(nombres[-2:], ['Cara', 'Media'])
+
+
+class ProductConditionalGetTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.p = Product.objects.create(nombre='Bota Condicional', precio=Decimal('70.00'), stock=5)
+		self.talla = ProductSize.objects.create(producto=self.p, talla='40', stock=2)
+
+	def _revalidar(self, url, response, **params):
+		return self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+
+	def test_catalogo_responde_304_sin_renderizar(self):
+		url = reverse('product:product_list')
+		response = self.client.get(url, {'orden': 'precio'})
+		self.assertIn('Cookie', response['Vary'])
+		self.assertIn('private', response['Cache-Control'])
+
+		with self.assertTemplateNotUsed('product_list.html'):
+			repetida = self._revalidar(url, response, orden='precio')
+		self.assertEqual(repetida.status_code, 304)
+		# Other filters are a different resource version
+		self.assertEqual(self._revalidar(url, response, orden='-precio').status_code, 200)
+
+		self.p.precio = Decimal('60.00')
+		self.p.save()
+		self.assertEqual(self._revalidar(url, response, orden='precio').status_code, 200)
+
+	def test_catalogo_last_modified_para_visitantes_sin_carrito(self):
+		url = reverse('product:product_list')
+		response = self.client.get(url)
+		repetida = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+		self.assertEqual(repetida.status_code, 304)
+
+	def test_last_modified_avanza_al_borrar_un_producto(self):
+		hace_una_hora = timezone.now() - timedelta(hours=1)
+		Product.objects.update(modificado=hace_una_hora)
+		cache.set(sugerencias.CLAVE_CAMBIO, hace_una_hora, timeout=None)
+		url = reverse('product:product_list')
+		response = self.client.get(url)
+
+		# A visitor without cookies gets a new CSRF secret each time, so only the date can validate
+		self.client.cookies.clear()
+		Product.objects.create(nombre='Otra', precio=Decimal('10.00')).delete()
+		Product.objects.update(modificado=hace_una_hora)
+		repetida = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+		self.assertEqual(repetida.status_code, 200)
+
+	def test_ficha_cambia_con_el_stock_y_el_carrito(self):
+		url = reverse('product:product_detail', args=[self.p.slug])
+		response = self.client.get(url)
+		self.assertNotIn('Last-Modified', response)
+		self.assertEqual(self._revalidar(url, response).status_code, 304)
+
+		# A purchase elsewhere moves the stock with a plain UPDATE
+		ProductSize.objects.filter(pk=self.talla.pk).update(stock=1)
+		self.assertEqual(self._revalidar(url, response).status_code, 200)
+
+		response = self.client.get(url)
+		self.client.post(reverse('agregar_al_carrito', args=[self.p.id]), {'talla_id': self.talla.id, 'cantidad': 1})
+		self.assertEqual(self._revalidar(url, response).status_code, 200)
+
+
+class ProductApiTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.cat = Category.objects.create(nombre='Botas')
+		self.marca = Brand.objects.create(nombre='Rodriguez')
+		self.productos = []
+		for i in range(5):
+			p = Product.objects.create(
+				nombre=f'Bota API {i}', precio=Decimal('50.00') + i, categoria=self.cat, marca=self.marca,
+				creado=timezone.now() - timedelta(days=i),
+			)
+			ProductSize.objects.create(producto=p, talla='40', stock=i)
+			ProductImage.objects.create(producto=p, imagen=f'https://example.com/{i}.jpg', es_principal=True)
+			self.productos.append(p)
+
+	def test_campos_elegidos(self):
+		response = self.client.get(reverse('api_v1:productos'), {'campos': 'nombre,precio_final,marca'})
+		self.assertEqual(response.status_code, 200)
+		primero = response.json()['resultados'][0]
+		self.assertEqual(primero, {'nombre': 'Bota API 0', 'precio_final': '50.00', 'marca': 'rodriguez'})
+		self.assertIn('public', response['Cache-Control'])
+
+	def test_campo_desconocido_da_400(self):
+		response = self.client.get(reverse('api_v1:productos'), {'campos': 'nombre,coste'})
+		self.assertEqual(response.status_code, 400)
+		self.assertFalse(response.json()['success'])
+
+	def test_expandir_con_consultas_fijas(self):
+		url = reverse('api_v1:productos')
+		# Page, sizes and images: three queries whatever the page size
+		with self.assertNumQueries(3):
+			response = self.client.get(url, {'expandir': 'marca,categoria,tallas,imagenes', 'limite': 5})
+		resultados = response.json()['resultados']
+		self.assertEqual(len(resultados), 5)
+		self.assertEqual(resultados[0]['marca']['nombre'], 'Rodriguez')
+		self.assertEqual(resultados[0]['categoria']['slug'], 'botas')
+		self.assertEqual(resultados[1]['tallas'], [{'id': self.productos[1].tallas.get().id, 'talla': '40', 'stock': 1}])
+		self.assertEqual(resultados[1]['imagenes'][0]['imagen'], 'https://example.com/1.jpg')
+
+	def test_paginas_por_cursor(self):
+		url = reverse('api_v1:productos')
+		pagina = self.client.get(url, {'campos': 'id', 'limite': 2, 'orden': '-precio'}).json()
+		ids = [p['id'] for p in pagina['resultados']]
+		while pagina['siguiente']:
+			pagina = self.client.get(pagina['siguiente']).json()
+			ids += [p['id'] for p in pagina['resultados']]
+		self.assertEqual(ids, [p.id for p in reversed(self.productos)])
+
+	def test_ficha_y_404(self):
+		p = self.productos[0]
+		response = self.client.get(reverse('api_v1:producto', args=[p.slug]), {'expandir': 'tallas'})
+		self.assertEqual(response.json()['slug'], p.slug)
+		self.assertEqual(len(response.json()['tallas']), 1)
+		self.assertEqual(self.client.get(reverse('api_v1:producto', args=['no-existe'])).status_code, 404)
+
+	def test_etag_y_304(self):
+		url = reverse('api_v1:productos')
+		response = self.client.get(url, {'campos': 'nombre'})
+		repetida = self.client.get(url, {'campos': 'nombre'}, HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEqual(repetida.status_code, 304)
+
+		self.productos[0].nombre = 'Bota renombrada'
+		self.productos[0].save()
+		repetida = self.client.get(url, {'campos': 'nombre'}, HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEqual(repetida.status_code, 200)
+		# Stock moves without touching `modificado`: no validator
+		self.assertNotIn('ETag', self.client.get(url, {'campos': 'stock'}))
+
+	def test_imagenes_como_url_absoluta(self):
+		self.marca.imagen = 'marcas/rodriguez.png'
+		self.marca.save()
+		ProductImage.objects.create(producto=self.productos[0], imagen='/media/bota-0.jpg', orden=1)
+		data = self.client.get(reverse('api_v1:producto', args=[self.productos[0].slug]), {'expandir': 'imagenes'}).json()
+		self.assertEqual(
+			[i['imagen'] for i in data['imagenes']],
+			['https://example.com/0.jpg', 'http://testserver/media/bota-0.jpg'],
+		)
+		marcas = self.client.get(reverse('api_v1:marcas'), {'campos': 'imagen'}).json()
+		self.assertEqual(marcas['resultados'], [{'imagen': 'http://testserver/marcas/rodriguez.png'}])
+
+	def test_categorias_y_marcas(self):
+		categorias = self.client.get(reverse('api_v1:categorias'), {'campos': 'slug,nombre'}).json()
+		self.assertEqual(categorias['resultados'], [{'slug': 'botas', 'nombre': 'Botas'}])
+		marcas = self.client.get(reverse('api_v1:marcas')).json()
+		self.assertEqual(marcas['resultados'][0]['slug'], 'rodriguez')
@@ -5,5 +5,7 @@ app_name = 'product'
 
 urlpatterns = [
     path('', views.product_list, name='product_list'),
+    # Dos segmentos: ninguna ruta de ficha (<slug>/) puede taparla
+    path('buscar/sugerencias/', views.sugerencias, name='sugerencias'),
     path('<slug:slug>/', views.product_detail, name='product_detail'),
 ]
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Validadores para GET condicional (ETag / Last-Modified) del catálogo y la ficha.
+
+Se calculan con una o dos consultas agregadas, sin renderizar nada, y si el cliente ya
+tiene esa versión la vista responde 304. Las páginas pintan también el carrito, el
+usuario y un token CSRF, así que esos datos entran en el ETag; si hay mensajes
+pendientes no se valida (la página tiene que mostrarlos y consumirlos).
+
+Last-Modified solo se da en el catálogo y a visitantes sin sesión ni carrito: la fecha
+de modificación de los productos no refleja el carrito ni los cambios de stock. Incluye
+la hora de la última subida de versión del catálogo, que cubre los borrados.
+La API JSON (product/api.py) no pinta nada del visitante y usa solo la parte del catálogo.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import Max
+from django.middleware.csrf import get_token
+from django.utils import timezone
+
+from pedido.carrito_anonimo import COOKIE_CARRITO
+from pedido.middleware import huella_carrito
+from pedido.stock import liberar_reservas_si_toca
+from . import detalle, sugerencias
+from .models import Product, ProductSize
+
+
+def _etag(*partes):
+    return hashlib.md5(repr(partes).encode()).hexdigest()
+
+
+def _visitante(request):
+    """Lo que cada página pinta del visitante, o None si tiene mensajes pendientes."""
+    if len(get_messages(request)):
+        return None
+    # get_token() fija el secreto CSRF ya en esta petición, para que la primera visita y
+    # las siguientes (que ya traen la cookie) compartan ETag
+    get_token(request)
+    return (
+        request.user.pk,
+        huella_carrito(request),
+        request.META['CSRF_COOKIE'],
+    )
+
+
+def _ultimo_cambio(request):
+    """
+    Último cambio del catálogo, una vez por petición: el mayor `modificado` (por índice, sin
+    recorrer la tabla) o la última subida de versión, que es lo único que dejan los borrados.
+    """
+    if not hasattr(request, '_ultimo_cambio'):
+        modificado = Product.objects.aggregate(ultimo=Max('modificado'))['ultimo']
+        version = cache.get(sugerencias.CLAVE_CAMBIO)
+        if version is None:
+            # Sin rastro en la caché (vacía o expulsada) se toma ahora: mejor revalidar de más
+            # que dar por buena una copia que aún lista un producto borrado
+            cache.add(sugerencias.CLAVE_CAMBIO, timezone.now(), timeout=None)
+            version = cache.get(sugerencias.CLAVE_CAMBIO)
+        request._ultimo_cambio = max(fecha for fecha in (modificado, version) if fecha is not None)
+    return request._ultimo_cambio
+
+
+def etag_catalogo(request):
+    visitante = _visitante(request)
+    if visitante is None:
+        return None
+    return _etag(
+        'catalogo', _ultimo_cambio(request),
+        # Sube al guardar o borrar productos, categorías y marcas: cubre también los borrados
+        cache.get(sugerencias.CLAVE_VERSION, 0),
+        sorted(request.GET.lists()), visitante,
+    )
+
+
+def ultima_modificacion_catalogo(request):
+    if request.user.is_authenticated or request.COOKIES.get(COOKIE_CARRITO):
+        return None
+    return _ultimo_cambio(request)
+
+
+def etag_ficha(request, slug):
+    # El stock que se muestra no debe contar reservas ya caducadas
+    liberar_reservas_si_toca()
+    visitante = _visitante(request)
+    if visitante is None:
+        return None
+    producto = Product.objects.filter(slug=slug, disponible=True).values_list('pk', 'modificado', 'stock').first()
+    if producto is None:
+        return None
+    # El stock cambia con las compras sin tocar `modificado`
+    tallas = list(ProductSize.objects.filter(producto_id=producto[0]).order_by('id').values_list('id', 'stock'))
+    return _etag('ficha', producto, tallas, detalle.version_ficha(slug), visitante)
+
+
+def _lista(request, parametro):
+    return {valor.strip() for valor in request.GET.get(parametro, '').split(',')}
+
+
+def etag_api(request, slug=None):
+    """ETag de la API de catálogo; sin validador si se pide stock, que cambia sin `modificado`."""
+    if 'stock' in _lista(request, 'campos') or 'tallas' in _lista(request, 'expandir'):
+        return None
+    return _etag(
+        'api', request.path, _ultimo_cambio(request),
+        cache.get(sugerencias.CLAVE_VERSION, 0), sorted(request.GET.lists()),
+    )
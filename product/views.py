@@ -1,90 +1,140 @@
-from django.shortcuts import render, get_object_or_404
-from django.core.paginator import Paginator
-from .models import Product, Category, Brand
-from pedido.models import Carrito
-from client.models import Cliente
-
-
-def _get_carrito_context(request):
-    """Función auxiliar para obtener el carrito del usuario o sesión"""
-    carrito = None
-    if request.user.is_authenticated:
-        try:
-            cliente = Cliente.objects.get(user=request.user)
-            carrito = Carrito.objects.filter(cliente=cliente).first()
-        except Cliente.DoesNotExist:
-            pass
-    else:
-        if request.session.session_key:
-            carrito = Carrito.objects.filter(session_key=request.session.session_key).first()
-    return {'carrito': carrito}
+from decimal import Decimal
 
+from django.shortcuts import render
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+from .models import Product, Category, TALLAS_ESTANDAR
+from .search import buscar
+from .sugerencias import sugerir
+from .facetas import FACETAS, calcular_facetas
+from .paginacion import paginar_por_cursor
+from .tarjetas import tarjetas
+from .detalle import datos_detalle
+from .tallas import filtrar_por_talla
+from .validadores import etag_catalogo, ultima_modificacion_catalogo, etag_ficha
 
+
+# Ordenaciones del catálogo, resueltas en la BD; el id desempata para el cursor
+ORDENES = {
+    'nuevos': ('-creado', '-id'),
+    'precio': ('precio_final', 'id'),
+    '-precio': ('-precio_final', '-id'),
+}
+
+
+def _precio(valor):
+    """Precio de un filtro de la URL, o None si falta o no es un número válido."""
+    try:
+        precio = Decimal(valor)
+    except (TypeError, ArithmeticError):
+        return None
+    return precio if precio.is_finite() and precio >= 0 else None
+
+
+# Las páginas llevan el carrito del visitante: solo caché privada, revalidada cada vez
+@vary_on_cookie
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag_catalogo, last_modified_func=ultima_modificacion_catalogo)
 def product_list(request):
     """Lista de productos con filtros"""
-    products = Product.objects.filter(disponible=True).select_related('categoria', 'marca').prefetch_related('imagenes')
+    products = Product.objects.filter(disponible=True).select_related('categoria', 'marca')
     
     # Filtros
-    categoria_slug = request.GET.get('categoria')
-    marca_slug = request.GET.get('marca')
-    genero = request.GET.get('genero')
     search = request.GET.get('search')
-    
-    if categoria_slug:
-        products = products.filter(categoria__slug=categoria_slug)
-    if marca_slug:
-        products = products.filter(marca__slug=marca_slug)
-    if genero:
-        products = products.filter(genero=genero)
+    seleccion = {faceta: request.GET.get(faceta) or '' for faceta in FACETAS}
+
+    talla = request.GET.get('talla') or ''
+    orden = request.GET.get('orden') or ''
+    precio_min = _precio(request.GET.get('precio_min'))
+    precio_max = _precio(request.GET.get('precio_max'))
+
     if search:
-        products = products.filter(nombre__icontains=search)
-    
-    # Paginación
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    # Datos para filtros
-    categorias = Category.objects.all()
-    marcas = Brand.objects.all()
+        products = buscar(products, search)
+    if talla:
+        products = filtrar_por_talla(products, talla)
+    if precio_min is not None:
+        products = products.filter(precio_final__gte=precio_min)
+    if precio_max is not None:
+        products = products.filter(precio_final__lte=precio_max)
+    # Los recuentos de las facetas parten de la búsqueda, la talla y el precio, antes de filtrar por ellas
+    sin_facetas = products
+
+    if seleccion['categoria']:
+        products = products.filter(categoria__slug=seleccion['categoria'])
+    if seleccion['marca']:
+        products = products.filter(marca__slug=seleccion['marca'])
+    if seleccion['genero']:
+        products = products.filter(genero=seleccion['genero'])
+    if seleccion['color']:
+        products = products.filter(color=seleccion['color'])
+    if seleccion['material']:
+        products = products.filter(material=seleccion['material'])
     
+    if orden in ORDENES:
+        products = products.order_by(*ORDENES[orden])
+
+    # Paginación por cursor sobre (creado, id): sin COUNT(*) ni OFFSET
+    page_obj = paginar_por_cursor(products, request.GET.get('cursor'), 12)
+    siguiente_query = _siguiente_query(request, page_obj)
+
+    if request.GET.get('formato') == 'json':
+        datos = {
+            'html': ''.join(tarjetas(page_obj)),
+            'siguiente': f'{request.path}?{siguiente_query}' if siguiente_query else None,
+        }
+        # El total exacto cuesta un COUNT(*) sobre el conjunto filtrado: solo si se pide
+        if request.GET.get('total'):
+            datos['total'] = products.count()
+        return JsonResponse(datos)
+
     context = {
         'page_obj': page_obj,
-        'categorias': categorias,
-        'marcas': marcas,
-        'categoria_actual': categoria_slug,
-        'marca_actual': marca_slug,
-        'genero_actual': genero,
+        'tarjetas': tarjetas(page_obj),
+        'siguiente_query': siguiente_query,
+        # Solo la página completa pinta las facetas: el scroll infinito (JSON) no las calcula
+        'facetas': calcular_facetas(sin_facetas, seleccion),
+        'categoria_actual': seleccion['categoria'],
+        'marca_actual': seleccion['marca'],
+        'genero_actual': seleccion['genero'],
+        'color_actual': seleccion['color'],
+        'material_actual': seleccion['material'],
+        'tallas': TALLAS_ESTANDAR,
+        'talla_actual': talla,
+        'orden_actual': orden,
+        'precio_min': precio_min,
+        'precio_max': precio_max,
         'search_query': search,
     }
     
-    # Añadir carrito al contexto
-    context.update(_get_carrito_context(request))
-    
     return render(request, 'product_list.html', context)
 
 
+def _siguiente_query(request, page_obj):
+    """Parámetros de la página siguiente: los filtros actuales con el nuevo cursor."""
+    if not page_obj.has_next():
+        return ''
+    params = request.GET.copy()
+    params.pop('formato', None)
+    params.pop('total', None)
+    params['cursor'] = page_obj.siguiente
+    return params.urlencode()
+
+
+def sugerencias(request):
+    """Sugerencias del buscador para el prefijo `q`, servidas desde el índice en memoria."""
+    return JsonResponse(sugerir(request.GET.get('q', '')[:50]))
+
+
+@vary_on_cookie
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag_ficha)
 def product_detail(request, slug):
     """Detalle de producto"""
-    product = get_object_or_404(
-        Product.objects.prefetch_related('imagenes', 'tallas').select_related('categoria', 'marca'),
-        slug=slug,
-        disponible=True
-    )
-    
-    # Productos relacionados (misma categoría)
-    related_products = Product.objects.filter(
-        categoria=product.categoria,
-        disponible=True
-    ).exclude(id=product.id).prefetch_related('imagenes')[:4]
-    
-    context = {
-        'product': product,
-        'related_products': related_products,
-    }
-    
-    # Añadir carrito al contexto
-    context.update(_get_carrito_context(request))
+    # Las reservas caducadas ya se han liberado al calcular el ETag (etag_ficha)
+    # Producto, relacionados y sus tarjetas salen de la caché; el stock se relee siempre
+    context = datos_detalle(slug)
     
     return render(request, 'product_detail.html', context)
 
@@ -103,7 +153,4 @@ def home(request):
         'categorias': categorias,
     }
     
-    # Añadir carrito al contexto
-    context.update(_get_carrito_context(request))
-    
     return render(request, 'home.html', context)
\ No newline at end of file
@@ -65,6 +65,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'pedido.middleware.CarritoMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -158,3 +159,20 @@ STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY", "")
 
 RESEND_API_KEY = os.getenv("RESEND_API_KEY")
+
+# Minutos que un carrito retiene el stock de sus líneas sin actividad
+CARRITO_RESERVA_MINUTOS = int(os.getenv("CARRITO_RESERVA_MINUTOS", 30))
+# Cada cuántos segundos, como mucho, se liberan reservas caducadas al consultar stock
+CARRITO_LIBERACION_SEGUNDOS = int(os.getenv("CARRITO_LIBERACION_SEGUNDOS", 60))
+# Vida de la cookie firmada que guarda el carrito de los visitantes anónimos
+CARRITO_COOKIE_SEGUNDOS = int(os.getenv("CARRITO_COOKIE_SEGUNDOS", 60 * 60 * 24 * 30))
+# Refresco máximo del índice en memoria de sugerencias del buscador (product/sugerencias.py)
+SUGERENCIAS_REFRESCO_SEGUNDOS = int(os.getenv("SUGERENCIAS_REFRESCO_SEGUNDOS", 300))
+# Caducidad de los fragmentos HTML de las tarjetas de producto (product/tarjetas.py)
+TARJETAS_CACHE_SEGUNDOS = int(os.getenv("TARJETAS_CACHE_SEGUNDOS", 60 * 60 * 24))
+# Cada cuánto se vuelve a barajar el pool de destacados de la portada (product/destacados.py)
+DESTACADOS_REFRESCO_SEGUNDOS = int(os.getenv("DESTACADOS_REFRESCO_SEGUNDOS", 60 * 15))
+# Caducidad de los datos cacheados de la ficha de producto (product/detalle.py)
+DETALLE_CACHE_SEGUNDOS = int(os.getenv("DETALLE_CACHE_SEGUNDOS", 60 * 10))
+# max-age público de las respuestas de la API JSON del catálogo (product/api.py)
+API_CACHE_SEGUNDOS = int(os.getenv("API_CACHE_SEGUNDOS", 60))
@@ -23,6 +23,7 @@ urlpatterns = [
     path('', homeViews.home, name="home"),
     path('admin/', admin.site.urls),
     path('productos/', include('product.urls', namespace='product')),
+    path('api/v1/', include('product.api_urls', namespace='api_v1')),
     path('clientes/', include('client.urls')),
     
     path('carrito/', pedidoViews.carrito_compra, name='carrito_compra'),  # ← La mantuve
@@ -30,6 +31,8 @@ urlpatterns = [
     path('carrito/actualizar/<int:item_id>/', pedidoViews.actualizar_cantidad_carrito, name='actualizar_cantidad_carrito'),  # ← Nueva
     path('carrito/eliminar/<int:item_id>/', pedidoViews.eliminar_del_carrito, name='eliminar_del_carrito'),  # ← Nueva
     path('carrito/vaciar/', pedidoViews.vaciar_carrito, name='vaciar_carrito'),  # ← Nueva
+    path('carrito/fragmento/', pedidoViews.carrito_fragmento, name='carrito_fragmento'),
+    path('carrito/lote/', pedidoViews.carrito_lote, name='carrito_lote'),
     
     path('pedidos/', pedidoViews.listado_pedidos, name='pedidos'),
     path('pedidos/<int:pedido_id>/', pedidoViews.detalle_pedido, name='detalle_pedido'),